@@ -0,0 +1,114 @@
+import numpy as np
+
+from plan import PlanLP, PlanResult
+from planner import Planner
+from instrument import emit
+
+
+def restrict(plan, critical_keep, tumor_keep):
+    """Return a copy of the plan with only some of its critical and tumor rows, given as positions"""
+    
+    critical_keep, tumor_keep = np.asarray(critical_keep, dtype = int), np.asarray(tumor_keep, dtype = int)
+    return PlanLP(plan.name, plan.D, plan.critical_rows[critical_keep], plan.tumor_rows[tumor_keep],
+                  plan.max_dose, plan.min_dose, plan.beam_cost,
+                  plan.critical_cost[critical_keep] if plan.num_critical_slack else None,
+                  plan.tumor_cost[tumor_keep] if plan.num_tumor_surplus else None,
+                  plan.critical_ub, plan.tumor_ub, plan.log_output, 
+                  plan.threads, plan.time_limit)
+
+
+def violations(plan, x, tol = 1e-7):
+    """Return the positions of critical rows over the dose limit and tumor rows under it for intensities x"""
+    
+    dose = plan.D.matrix @ np.asarray(x, dtype = float)
+    critical = np.flatnonzero(dose[plan.critical_rows] > plan.max_dose + tol)
+    tumor = np.flatnonzero(dose[plan.tumor_rows] < plan.min_dose - tol)
+    
+    return critical, tumor
+
+
+def solve_active_set(plan, critical_active, tumor_active, backend = 'highs', batch = None, max_rounds = 100,
+                     start = None):
+    """Solve a plan starting from a subset of its rows, adding violated rows and re-solving warm
+    until every row holds; the result matches the full plan's optimum
+    
+    A dropped row that holds at the optimum has zero slack/surplus, so it adds nothing to the objective.
+    critical_active and tumor_active are positions into plan.critical_rows and plan.tumor_rows. If
+    max_rounds runs out first, the result may still violate dropped rows: it has converged = False
+    and an active_set_unconverged warning is emitted. start, a PlanResult or beam intensities, warm-starts
+    the first solve."""
+    
+    critical_active = np.unique(np.asarray(critical_active, dtype = int))
+    tumor_active = np.unique(np.asarray(tumor_active, dtype = int))
+    planner = Planner(restrict(plan, critical_active, tumor_active), backend)
+    if start is not None:
+        planner.set_start(start)
+    
+    rounds, converged, iterations = 0, False, 0
+    while True:
+        result = planner.solve()
+        rounds += 1
+        if result is None:
+            return None
+        iterations += result.iterations or 0
+        critical, tumor = violations(plan, result.x)
+        critical = np.setdiff1d(critical, critical_active)
+        tumor = np.setdiff1d(tumor, tumor_active)
+        converged = len(critical) == 0 and len(tumor) == 0
+        if converged or rounds >= max_rounds:
+            break
+        
+        # Add the worst violations first when the batch size is limited
+        if batch is not None:
+            dose = plan.D.matrix @ result.x
+            critical = critical[np.argsort(-dose[plan.critical_rows[critical]])][:batch]
+            tumor = tumor[np.argsort(dose[plan.tumor_rows[tumor]])][:batch]
+        planner.add_rows(plan.critical_rows[critical], plan.tumor_rows[tumor],
+                         plan.critical_cost[critical] if plan.num_critical_slack else None,
+                         plan.tumor_cost[tumor] if plan.num_tumor_surplus else None)
+        critical_active = np.concatenate((critical_active, critical))
+        tumor_active = np.concatenate((tumor_active, tumor))
+    
+    # Rows that were never added hold without slack or surplus
+    critical_slack = np.zeros(plan.num_critical_slack)
+    tumor_surplus = np.zeros(plan.num_tumor_surplus)
+    if plan.num_critical_slack:
+        critical_slack[critical_active] = result.critical_slack
+    if plan.num_tumor_surplus:
+        tumor_surplus[tumor_active] = result.tumor_surplus
+    solved = PlanResult(result.x, critical_slack, tumor_surplus, result.objective_value, 
+                        backend, result.solve_time, result.solution, iterations)
+    solved.rounds = rounds
+    solved.active_rows = (len(critical_active), len(tumor_active))
+    solved.converged = converged
+    if not converged:
+        emit('active_set_unconverged', rounds = rounds, critical_violated = len(critical), tumor_violated = len(tumor),
+             message = 'WARNING: ' + str(len(critical) + len(tumor)) + ' dropped rows still violated after ' 
+                       + str(rounds) + ' rounds; the result is not the full plan optimum')
+    
+    return solved
+
+
+
+def seed_critical(plan, size = None):
+    """Return the positions of the critical rows most likely to bind: those dosed most heavily by
+    the beams that reach the tumor, size of them (by default a twentieth of the critical rows)"""
+    
+    n = len(plan.critical_rows)
+    size = max(1, n // 20) if size is None else min(size, n)
+    if n == 0:
+        return np.zeros(0, dtype = int)
+    
+    # Weight each beam by the tumor dose it delivers, then score critical rows by that weighted dose
+    tumor_weight = np.asarray(plan.D.matrix[plan.tumor_rows].sum(axis = 0)).ravel()
+    score = plan.D.matrix[plan.critical_rows] @ tumor_weight
+    
+    return np.sort(np.argpartition(-score, size - 1)[:size])
+
+
+def solve_lazy(plan, backend = 'highs', seed = None, batch = None, max_rounds = 100):
+    """Solve a plan with every tumor row but only a seed set of critical rows, adding the critical
+    rows that end up over the limit until none are; the result matches the full plan's optimum"""
+    
+    return solve_active_set(plan, seed_critical(plan, seed), np.arange(0, len(plan.tumor_rows)), 
+                            backend, batch, max_rounds)
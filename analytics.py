@@ -2,52 +2,91 @@ import pandas as pd
 import numpy as np
 from matplotlib import pyplot as plt
 
+from influence import DoseInfluence
+from magnetic import magnetic_beams
+
+def intensities(sol):
+    """Return the beam intensities of a solved plan, or pass a vector or (plans, beams) stack through"""
+    
+    return np.asarray(sol.x if hasattr(sol, 'x') else sol, dtype = float)
+
+
+
+def dose_maps(x, *beam_sets):
+    """Return the dose map for an intensity vector, or a stack of maps for a (plans, beams) array,
+    where the columns of x run over the beam sets in order"""
+    
+    x = np.asarray(x, dtype = float)
+    X = np.atleast_2d(x)
+    m, start = None, 0
+    for b in beam_sets:
+        if isinstance(b, DoseInfluence):
+            n, grid_shape = b.num_beams, b.grid_shape
+            part = (b.matrix @ X[:, start:start + n].T).T
+        else:
+            b = np.asarray(b)
+            n, grid_shape = b.shape[0], b.shape[1:]
+            part = X[:, start:start + n] @ b.reshape(n, -1)
+        m = part if m is None else m + part
+        start += n
+    m = m.reshape((X.shape[0],) + tuple(grid_shape))
+    
+    return m[0] if x.ndim == 1 else m
+
+
+
 def calc_m(sol, b, print_vars = False):
     """Calculate the sum of radiation in each cell of the matrix"""
 
-    sol_l = []
-    for var, value in sol.iter_var_values():
-        if str(var)[0] == 'x':
-            if print_vars == True:
-                print(var, value)
-            sol_l.append([str(var)[1:], value])
-
-    first = True
-    for i in range(0, len(sol_l)):
-        if first == True:
-            first = False
-            m = b[int(sol_l[i][0])-1].copy() * sol_l[i][1]
-        else:
-            m = m + b[int(sol_l[i][0])-1].copy() * sol_l[i][1]    
+    x = intensities(sol)
+    if print_vars == True and x.ndim == 1:
+        for i in np.flatnonzero(x):
+            print('x' + str(i + 1), x[i])
     
-    return m
+    return dose_maps(x, b)
+
+
+
+def coverage(m, c, t, max_rad = 2, min_rad = 10):
+    """Return the percent of critical cells at or under max_rad and tumor cells at or over min_rad"""
+    
+    c, t = np.asarray(c) == 1, np.asarray(t) == 1
+    critical_pct = 100 * np.count_nonzero(m[c] <= max_rad) / max(np.count_nonzero(c), 1)
+    tumor_pct = 100 * np.count_nonzero(m[t] >= min_rad) / max(np.count_nonzero(t), 1)
+    
+    return critical_pct, tumor_pct
+
+
 
+# Overlay colormaps built by region_cmaps on first use
+_CMAPS = []
 
 
-def plot_beams(sol, b, c, t, cmap_choice = 'magma', print_vars = False, magnetic = False):
+def region_cmaps():
+    """Return the translucent green-to-red critical and red-to-green tumor overlay colormaps, built once"""
+    
+    if not _CMAPS:
+        from matplotlib.colors import colorConverter, LinearSegmentedColormap, ListedColormap
+        color1 = colorConverter.to_rgba('green')
+        color2 = colorConverter.to_rgba('red')
+        for name, colors in (('critical_cmap', [color1, color2]), ('tumor_cmap', [color2, color1])):
+            # Fade the alpha in from fully transparent, so the dose map shows through
+            lut = LinearSegmentedColormap.from_list(name, colors, 256)(np.linspace(0, 1, 256))
+            lut[:, -1] = np.linspace(0, 0.25, 256)
+            _CMAPS.append(ListedColormap(lut, name = name))
+    
+    return tuple(_CMAPS)
+
+
+def plot_beams(sol, b, c, t, cmap_choice = 'magma', print_vars = False, magnetic = False, intensity = 0.75):
     """Plot the path of the beams in python"""
 
     # Get basic matrices
     if magnetic == False:
         m = calc_m(sol, b, print_vars)
     else:
-        m = magnetic_calc_m(sol, b, print_vars)
-    m_c_empty, m_t_empty = False, False
-
-    from matplotlib.colors import colorConverter
-    import matplotlib as mpl
-    color1 = colorConverter.to_rgba('green')
-    color2 = colorConverter.to_rgba('red')
-    critical_cmap = mpl.colors.LinearSegmentedColormap.from_list('critical_cmap',[color1,color2],256)
-    critical_cmap._init()
-    alpha_c = np.linspace(0, 0.25, critical_cmap.N+3)
-    critical_cmap._lut[:,-1] = alpha_c
-
-    tumor_cmap = mpl.colors.LinearSegmentedColormap.from_list('critical_cmap',[color2,color1],256)
-    tumor_cmap._init()
-    alpha_t = np.linspace(0, 0.25, tumor_cmap.N+3)
-    tumor_cmap._lut[:,-1] = alpha_t
-
+        m = magnetic_calc_m(sol, b, print_vars, intensity)
+    critical_cmap, tumor_cmap = region_cmaps()
 
     fig, ax = plt.subplots(figsize=(12, 12))
     ax.imshow(m, cmap=cmap_choice)
@@ -61,58 +100,93 @@ def plot_beams(sol, b, c, t, cmap_choice = 'magma', print_vars = False, magnetic
 
 
 
-def report_effectiveness(sol, b, c, t, max_rad = 2, min_rad = 10, print_vars = False, plot = True, magnetic = False):
+def region_doses(m, mask):
+    """Return the doses inside a region as a (plans, pixels) array, for one dose map or a stack"""
+    
+    mask = np.asarray(mask)
+    return np.asarray(m).reshape(-1, mask.size)[:, np.flatnonzero(mask.ravel() == 1)]
+
+
+
+def dose_volume_histogram(m, mask, levels):
+    """Return, per plan, the fraction of a region receiving at least each dose level, in the order given"""
+    
+    R = region_doses(m, mask)
+    order = np.argsort(np.asarray(levels, dtype = float), kind = 'stable')
+    levels = np.asarray(levels, dtype = float)[order]
+    n, p, L = R.shape[0], R.shape[1], len(levels)
+    
+    # Count the pixels above each number of levels with one bincount, offset per plan
+    idx = np.searchsorted(levels, R, side = 'right') + (L + 1) * np.arange(0, n)[:, None]
+    counts = np.bincount(idx.ravel(), minlength = n * (L + 1)).reshape(n, L + 1)
+    at_least = np.cumsum(counts[:, ::-1], axis = 1)[:, ::-1][:, 1:]
+    
+    # Columns back in the caller's order of levels
+    result = np.empty_like(at_least, dtype = float)
+    result[:, order] = at_least / max(p, 1)
+    
+    return result
+
+
+
+def dose_metrics(m, c, t, max_rad = 2, min_rad = 10, d_levels = (95,), v_levels = None):
+    """Return dose statistics per plan and region: total, mean, min, max, percent within limits,
+    D<x> (the dose reached by x% of the region) and V<y> (the percent receiving at least y)"""
+    
+    if v_levels is None:
+        v_levels = (max_rad, min_rad)
+    
+    frames = []
+    for region, mask in (('critical', c), ('tumor', t)):
+        R = region_doses(m, mask)
+        n, p = R.shape
+        df = pd.DataFrame({'plan': np.arange(0, n), 'region': region, 'pixels': p})
+        if p == 0:
+            frames.append(df)
+            continue
+        df['total'] = R.sum(axis = 1)
+        df['mean'] = df['total'] / p
+        df['min'] = R.min(axis = 1)
+        df['max'] = R.max(axis = 1)
+        within = R <= max_rad if region == 'critical' else R >= min_rad
+        df['pct_within'] = 100 * np.count_nonzero(within, axis = 1) / p
+        
+        # D<x>: at least x% of the region receives this dose, read from one partition
+        ks = [min(max(p - int(np.ceil(d * p / 100)), 0), p - 1) for d in d_levels]
+        part = np.partition(R, ks, axis = 1)
+        for d, k in zip(d_levels, ks):
+            df['D' + str(d)] = part[:, k]
+        for v, frac in zip(v_levels, dose_volume_histogram(R, np.ones(p), v_levels).T):
+            df['V' + str(v)] = 100 * frac
+        frames.append(df)
+    
+    return pd.concat(frames, ignore_index = True)
+
+
+
+def report_effectiveness(sol, b, c, t, max_rad = 2, min_rad = 10, print_vars = False, plot = True, magnetic = False, intensity = 0.75):
     """See how good the particular model is at providing radiation coverage"""
     
     # Get basic matrices
     if magnetic == False:
         m = calc_m(sol, b, print_vars)
     else:
-        m = magnetic_calc_m(sol, b, print_vars)
-    m_c_empty, m_t_empty = False, False
+        m = magnetic_calc_m(sol, b, print_vars, intensity)
+    metrics = dose_metrics(m, c, t, max_rad, min_rad)
     
     
-    # Critical area
-    m_c = [x for x in (m * c).flatten() if x > 0]
-    sum_m_c = sum(m_c)
-    if sum_m_c == 0:
-        m_c_empty = True
-    else:
-        len_m_c, len_c = len(m_c), len([x for x in c.flatten() if x == 1])
-        avg_m_c = sum_m_c / len_m_c
-        acceptable_m_c = len([x for x in m_c if x <= max_rad]) - len_m_c + len_c
-    
-    
-    # Tumor area
-    m_t = [x for x in (m * t).flatten() if x > 0]
-    sum_m_t = sum(m_t)
-    if sum_m_t == 0:
-        m_t_empty = True
-    if sum_m_t == None:
-        m_t_empty = True
-    else:
-        len_m_t, len_t = len(m_t), len([x for x in t.flatten() if x == 1])
-        avg_m_t = sum_m_t / len_m_t
-        acceptable_m_t = len([x for x in m_t if x >= min_rad]) - len_m_t + len_t
-        
-        
     # Print report
-    print('\nMODEL REPORT\n')    
-    if m_c_empty == False:
-        print(str(round(sum_m_c,1))+' units of radiation were delivered to critical cells.')
-        print(str(round(avg_m_c,1))+' units were delivered to each cell, on average.')
-        print(str(acceptable_m_c)+' cells were found to have acceptable levels of radiation, out of '+str(len_c)+'.')
-        print(str(round(100*acceptable_m_c / len_c,2))+'% of cells were found to have acceptable levels of radiation.\n')
-    else:
-        print('No units of radiation were delivered to any critical cells.\n')
-        
-    if m_t_empty == False:
-        print(str(round(sum_m_t,1))+' units of radiation were delivered to tumor cells.')
-        print(str(round(avg_m_t,1))+' units were delivered to each cell, on average.')
-        print(str(acceptable_m_t)+' cells were found to have acceptable levels of radiation, out of '+str(len_t)+'.')
-        print(str(round(100*acceptable_m_t / len_t,2))+'% of cells were found to have acceptable levels of radiation.')
-    else:
-        print('No units of radiation were delivered to any tumor cells.')
+    print('\nMODEL REPORT\n')
+    for _, row in metrics.iterrows():
+        cells = row['region'] + ' cells'
+        if row['pixels'] == 0 or row['total'] == 0:
+            print('No units of radiation were delivered to any ' + cells + '.\n')
+            continue
+        acceptable = int(round(row['pct_within'] * row['pixels'] / 100))
+        print(str(round(row['total'],1))+' units of radiation were delivered to '+cells+'.')
+        print(str(round(row['mean'],1))+' units were delivered to each cell, on average.')
+        print(str(acceptable)+' cells were found to have acceptable levels of radiation, out of '+str(row['pixels'])+'.')
+        print(str(round(row['pct_within'],2))+'% of cells were found to have acceptable levels of radiation.\n')
     
     
     # Plot if requested
@@ -131,97 +205,38 @@ def report_effectiveness(sol, b, c, t, max_rad = 2, min_rad = 10, print_vars = F
         plt.tight_layout()
         plt.show()
     
-    return None
+    return metrics
 
 
 
-def magnetic_calc_m(sol, b, print_vars = False):
+def magnetic_calc_m(sol, b, print_vars = False, intensity = 0.75):
     """Calculate the sum of radiation in each cell of the matrix"""
 
-    # Add two magnetic fields
-    left_b, right_b = np.copy(b), np.copy(b)
-    for beam in range(0, len(left_b)):
-        intensity = 0.75
-        for _ in range(0, len(left_b[beam])):
-            if _ < len(left_b)/2:
-                left_b[beam][_] = np.roll(left_b[beam][_],-int(_**intensity))
-            else:
-                left_b[beam][_] = np.roll(left_b[beam][_],-int((len(left_b[beam])-_)**intensity))
-    for beam in range(0, len(right_b)):
-        intensity = 0.75
-        for _ in range(0, len(right_b[beam])):
-            if _ < len(right_b)/2:
-                right_b[beam][_] = np.roll(right_b[beam][_],int(_**intensity))
-            else:
-                right_b[beam][_] = np.roll(right_b[beam][_],int((len(right_b[beam])-_)**intensity))
-    
-    # All together
-    b = np.concatenate((b, left_b, right_b), axis=0)
-    
-    
-    sol_l = []
-    for var, value in sol.iter_var_values():
-        if str(var)[0] == 'x':
-            if print_vars == True:
-                print(var, value)
-            sol_l.append([str(var)[1:], value])
-
-    first = True
-    for i in range(0, len(sol_l)):
-        if first == True:
-            first = False
-            m = b[int(sol_l[i][0])-1].copy() * sol_l[i][1]
-        else:
-            m = m + b[int(sol_l[i][0])-1].copy() * sol_l[i][1]    
+    # Add two magnetic fields; the intensities run over b, then left, then right
+    left_b, right_b = magnetic_beams(b, intensity)
     
-    return m
+    x = intensities(sol)
+    if print_vars == True and x.ndim == 1:
+        for i in np.flatnonzero(x):
+            print('x' + str(i + 1), x[i])
+    
+    return dose_maps(x, b, left_b, right_b)
 
 
 
-def plot_magnetic_shifts(a_b):
+def plot_magnetic_shifts(a_b, intensity = 0.75):
     """Plot the basic magnetic shifts."""
 
-    data_1 = np.copy(a_b)
-
-    fig, ax = plt.subplots(figsize=(6,6))
-    ax.imshow(sum(data_1), cmap='Blues')
-    plt.axis('off')
-    plt.title('No Shift')
-    plt.tight_layout()
-    plt.show()
-
-    data_2 = np.copy(a_b)
-
-    for beam in range(0, len(data_2)):
-        intensity = 0.75
-        for _ in range(0, len(data_2[beam])):
-            if _ < len(data_2)/2:
-                data_2[beam][_] = np.roll(data_2[beam][_],int(_**intensity))
-            else:
-                data_2[beam][_] = np.roll(data_2[beam][_],int((len(data_2[beam])-_)**intensity))
-
-    fig, ax = plt.subplots(figsize=(6,6))
-    ax.imshow(sum(data_2), cmap='Blues')
-    plt.axis('off')
-    plt.title('Shift Right: Magnet Intensity = '+str(intensity))
-    plt.tight_layout()
-    plt.show()
-
-    data_3 = np.copy(a_b)
-
-    for beam in range(0, len(data_3)):
-        intensity = 0.75
-        for _ in range(0, len(data_3[beam])):
-            if _ < len(data_3)/2:
-                data_3[beam][_] = np.roll(data_3[beam][_],-int(_**intensity))
-            else:
-                data_3[beam][_] = np.roll(data_3[beam][_],-int((len(data_3[beam])-_)**intensity))
-
-    fig, ax = plt.subplots(figsize=(6,6))
-    ax.imshow(sum(data_3), cmap='Blues')
-    plt.axis('off')
-    plt.title('Shift Left: Magnet Intensity = '+str(intensity))
-    plt.tight_layout()
-    plt.show()
+    left_b, right_b = magnetic_beams(a_b, intensity)
+    
+    for data, title in ((a_b, 'No Shift'),
+                        (right_b, 'Shift Right: Magnet Intensity = '+str(intensity)),
+                        (left_b, 'Shift Left: Magnet Intensity = '+str(intensity))):
+        fig, ax = plt.subplots(figsize=(6,6))
+        ax.imshow(np.sum(data, axis=0), cmap='Blues')
+        plt.axis('off')
+        plt.title(title)
+        plt.tight_layout()
+        plt.show()
 
-    return None
\ No newline at end of file
+    return None
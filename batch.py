@@ -0,0 +1,143 @@
+import os
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+import load_data as ld
+import models as md
+import analytics as an
+from plan import solve_plan
+from instrument import set_sink
+
+
+def thread_budget(processes, threads = None):
+    """Return the solver threads per job, so that processes x threads does not exceed the cores"""
+    
+    if threads is not None:
+        return threads
+    
+    return max(1, (os.cpu_count() or 1) // processes)
+
+
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+def _init_worker():
+    """Keep each worker quiet"""
+    
+    set_sink(None)
+
+
+def _run_case(folder_name, model_name, params, backend, threads, timeout):
+    """Load, build, and solve one case, returning its row of the summary table; never raises"""
+    
+    row = {'folder': folder_name, 'model': model_name, 'status': 'error'}
+    start = time.perf_counter()
+    try:
+        specs = ld.get_specs(folder_name)
+        c, t, b = ld.load_data(folder_name, specs)
+        row['load_s'] = time.perf_counter() - start
+    
+        mark = time.perf_counter()
+        plan = getattr(md, model_name)(specs, c, t, b, solve = False, **params)
+        plan, t_model = plan if isinstance(plan, tuple) else (plan, t)
+        plan.log_output, plan.threads = False, threads
+        row['build_s'] = time.perf_counter() - mark
+    
+        # The solver gets whatever is left of the case's time budget
+        if timeout is not None:
+            plan.time_limit = max(timeout - (time.perf_counter() - start), 1e-3)
+        mark = time.perf_counter()
+        sol = solve_plan(plan, backend)
+        row['solve_s'] = time.perf_counter() - mark
+    
+        if sol is None:
+            timed_out = timeout is not None and time.perf_counter() - start >= timeout
+            row['status'] = 'timeout' if timed_out else 'no_solution'
+        else:
+            hit_limit = backend == 'cplex' and sol.solution.solve_details.has_hit_limit()
+            m = plan.D.dose(sol.x)
+            critical_pct, tumor_pct = an.coverage(m, c, t_model, specs[3], specs[4])
+            row.update(status = 'timeout' if hit_limit else 'optimal', objective = sol.objective_value,
+                       critical_pct = critical_pct, tumor_pct = tumor_pct, iterations = sol.iterations)
+    except Exception as e:
+        row['error'] = repr(e)
+        row['traceback'] = traceback.format_exc()
+    row['total_s'] = time.perf_counter() - start
+    
+    return row
+
+
+def _run_pool(cases, processes, run_case, args):
+    """Run (index, folder) cases on one spawned pool; returns the rows of the cases that finished and
+    the cases left unfinished if a worker died and broke the pool"""
+    
+    rows, unfinished = {}, []
+    with ProcessPoolExecutor(max_workers = processes, mp_context = multiprocessing.get_context('spawn'),
+                             initializer = _init_worker) as pool:
+        futures = {pool.submit(run_case, folder, *args): (i, folder) for i, folder in cases}
+        for future in as_completed(futures):
+            try:
+                rows[futures[future][0]] = future.result()
+            except BrokenProcessPool:
+                unfinished.append(futures[future])
+    
+    return rows, sorted(unfinished)
+
+
+def run_batch(folders, model_name = 'build_model_4', params = None, backend = 'highs', processes = None,
+              threads = None, timeout = None, run_case = _run_case):
+    """Plan every case folder under task/task with one model variant on a process pool
+    
+    At most processes cases run at once, each solver limited to threads threads (by default the
+    cores shared out between the workers). timeout is a per-case budget in seconds that is passed
+    to the solver as a time limit. A case that fails, times out, or crashes its worker gets its own
+    status in the summary table and does not affect the others. run_case plans one case; it must be
+    importable by the spawned workers."""
+    
+    columns = ['folder', 'model', 'status', 'objective', 'critical_pct', 'tumor_pct', 
+               'load_s', 'build_s', 'solve_s', 'total_s']
+    if len(folders) == 0:
+        return pd.DataFrame(columns = columns)
+    params = {} if params is None else dict(params)
+    processes = max(1, min(len(folders), processes or os.cpu_count() or 1))
+    threads = thread_budget(processes, threads)
+    args = (model_name, params, backend, threads, timeout)
+    
+    # BLAS and OpenMP read their thread caps once, on import, so the workers are spawned fresh (and
+    # spawned on demand) while the caps are in the environment; the solvers get theirs through plan.threads
+    saved = {name: os.environ.get(name) for name in THREAD_VARIABLES}
+    os.environ.update({name: str(threads) for name in THREAD_VARIABLES})
+    try:
+        rows, unfinished = _run_pool(list(enumerate(folders)), processes, run_case, args)
+        
+        # A dead worker breaks the whole pool and fails every unfinished case with it, so those are
+        # rerun each on a pool of its own; only the case that crashes again is marked crashed
+        for k in range(0, len(unfinished), processes):
+            with ThreadPoolExecutor(max_workers = processes) as retry_pool:
+                retries = retry_pool.map(lambda case: _run_pool([case], 1, run_case, args), 
+                                           unfinished[k:k + processes])
+                for (i, folder), (retry, crashed) in zip(unfinished[k:k + processes], retries):
+                    rows.update(retry)
+                    if crashed:
+                        rows[i] = {'folder': folder, 'model': model_name, 'status': 'crashed',
+                                   'error': 'The worker process exited while planning this case'}
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    
+    # Keep the cases in the order they were given
+    summary = pd.DataFrame([rows[i] for i in range(0, len(folders))])
+    for name in columns[3:]:
+        if name not in summary:
+            summary[name] = np.nan
+    
+    return summary
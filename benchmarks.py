@@ -0,0 +1,319 @@
+import os
+import sys
+import json
+import time
+import platform
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+import load_data as ld
+import models as md
+from instrument import stage
+
+
+def _load_beams_per_beam(folder_name, specs):
+    """The original loader, which re-reads beam_raw.txt from the top for every beam"""
+    
+    beams, first, last = [], 0, specs[1]
+    for i in range(0, specs[0]):
+        beam = np.loadtxt('task/task/' + folder_name + '/beam_raw.txt', 
+                          skiprows = first,
+                          max_rows = last)
+        beams.append(beam)
+        first = first + specs[1] + 1
+        
+    return beams
+
+
+def _best_time(f, repeats):
+    """Return the fastest wall time of f() over a number of repeats, plus its last result"""
+    
+    best = np.inf
+    for _ in range(0, repeats):
+        start = time.perf_counter()
+        result = f()
+        best = min(best, time.perf_counter() - start)
+        
+    return best, result
+
+
+def compare_loaders(folders = ('smallexample', 'actualexample'), repeats = 3):
+    """Time the single-pass beam loader against the per-beam loader on each folder"""
+    
+    rows = []
+    for folder in folders:
+        specs = ld.get_specs(folder)
+        old_time, old_b = _best_time(lambda: _load_beams_per_beam(folder, specs), repeats)
+        new_time, new_b = _best_time(lambda: ld.load_beams(folder, specs), repeats)
+        rows.append({'folder': folder,
+                     'per_beam_s': old_time,
+                     'single_pass_s': new_time,
+                     'speedup': old_time / new_time,
+                     'identical': bool(np.array_equal(np.array(old_b), new_b))})
+    
+    return pd.DataFrame(rows)
+
+
+def compare_cache(folders = ('smallexample', 'actualexample'), repeats = 3):
+    """Time a text parse of each folder against a memory-mapped load from its binary cache"""
+    
+    rows = []
+    for folder in folders:
+        specs = ld.get_specs(folder, use_cache = False)
+        text_time, _ = _best_time(lambda: ld.load_data(folder, specs, use_cache = False), repeats)
+        ld.load_data(folder, specs)
+        cache_time, _ = _best_time(lambda: ld.load_data(folder, ld.get_specs(folder)), repeats)
+        rows.append({'folder': folder,
+                     'text_s': text_time,
+                     'cache_s': cache_time,
+                     'speedup': text_time / cache_time})
+    
+    return pd.DataFrame(rows)
+
+
+def _build_model_3_per_pixel(specs, c, t, b, p_neighbor = 0.5):
+    """The original build_model_3 assembly: one Python expression per pixel and bounds as constraints"""
+    
+    from docplex.mp.model import Model
+    from scipy import ndimage
+    model = Model(name = 'm1')
+    beam_range, vert_range, hori_range = range(0, specs[0]), range(0, specs[1]), range(0, specs[2])
+    
+    c_neighbor = ndimage.generic_filter(c, np.nanmean, size = 3, mode='constant', cval=0)
+    c_neighbor[c_neighbor > 0] = 1
+    for j in vert_range:
+        for k in hori_range:
+            if t[j,k] == 0:
+                c_neighbor[j,k] = c_neighbor[j,k] - c[j,k]
+    
+    x = model.continuous_var_list(keys=specs[0])
+    for i in range(0, specs[0]):
+        model.add_constraint(x[i] >= 0)
+    c_x = model.continuous_var_list(keys=[('critical_slack', j, k) for j in vert_range for k in hori_range])
+    for i in range(0, len(c_x)):
+        model.add_constraint(c_x[i] >= 0)
+        model.add_constraint(c_x[i] <= 1)
+    s_x = model.continuous_var_list(keys=[('tumor_surplus', j, k) for j in vert_range for k in hori_range])
+    for i in range(0, len(s_x)):
+        model.add_constraint(s_x[i] >= 0)
+        model.add_constraint(s_x[i] <= 20)
+    
+    for j in vert_range:
+        for k in hori_range:
+            if c[j,k] == 1:
+                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) - c_x[j * specs[2] + k] <= specs[3])
+            if t[j,k] == 1:
+                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) + s_x[j * specs[2] + k] >= specs[4])
+    
+    obj = model.objective_expr
+    for j in vert_range:
+        for k in hori_range:
+            obj += sum(x[i] * b[i][j,k] * (c[j,k] + p_neighbor * c_neighbor[j,k]) for i in beam_range) \
+                + c_x[j * specs[2] + k] * c[j,k] \
+                + s_x[j * specs[2] + k] * t[j,k]
+    model.minimize(obj)
+    
+    return model
+
+
+def compare_assembly(folders = ('smallexample', 'actualexample'), solve = True):
+    """Time the per-pixel build of model 3 against the batched build, and compare their optimal objectives"""
+    
+    rows = []
+    for folder in folders:
+        specs = ld.get_specs(folder)
+        c, t, b = ld.load_data(folder, specs)
+        old_time, old_model = _best_time(lambda: _build_model_3_per_pixel(specs, c, t, b), 1)
+        new_time, new_model = _best_time(lambda: md.build_model_3(specs, c, t, b, solve = False).to_docplex()[0], 1)
+        row = {'folder': folder,
+               'per_pixel_build_s': old_time,
+               'batched_build_s': new_time,
+               'speedup': old_time / new_time,
+               'per_pixel_constraints': old_model.number_of_constraints,
+               'batched_constraints': new_model.number_of_constraints}
+        
+        # The per-pixel model exceeds the CPLEX Community Edition limits on actualexample
+        if solve:
+            old_sol, new_sol = old_model.solve(), new_model.solve()
+            row['per_pixel_objective'] = old_sol.objective_value if old_sol else None
+            row['batched_objective'] = new_sol.objective_value if new_sol else None
+        rows.append(row)
+    
+    return pd.DataFrame(rows)
+
+
+def compare_backends(folders = ('smallexample', 'actualexample'), 
+                     models = ('build_model_2_1', 'build_model_3', 'build_model_4', 'build_model_5')):
+    """Time each model on the CPLEX and HiGHS backends and compare their objectives"""
+    
+    from plan import solve_plan
+    rows = []
+    for folder in folders:
+        specs = ld.get_specs(folder)
+        c, t, b = ld.load_data(folder, specs)
+        for name in models:
+            plan = getattr(md, name)(specs, c, t, b, solve = False)
+            plan = plan[0] if isinstance(plan, tuple) else plan
+            plan.log_output = False
+            row = {'folder': folder, 'model': name}
+            for backend in ('cplex', 'highs'):
+                wall, sol = _best_time(lambda: solve_plan(plan, backend), 1)
+                row[backend + '_s'] = wall
+                row[backend + '_objective'] = sol.objective_value if sol else None
+            rows.append(row)
+    
+    return pd.DataFrame(rows)
+
+
+def compare_resolve(folder = 'actualexample', p_neighbors = (0.25, 0.5, 1.0, 2.0), backend = 'highs'):
+    """Time a full rebuild and cold solve of model 3 per p_neighbor against in-place Planner re-solves"""
+    
+    from plan import solve_plan
+    from planner import Planner
+    from geometry import region_masks
+    specs = ld.get_specs(folder)
+    c, t, b = ld.load_data(folder, specs)
+    c_neighbor = region_masks(c, t)['c_neighbor']
+    
+    plan = md.build_model_3(specs, c, t, b, p_neighbor = p_neighbors[0], solve = False)
+    plan.log_output = False
+    planner = Planner(plan, backend)
+    planner.solve()
+    
+    rows = []
+    for p in p_neighbors:
+        def rebuild():
+            plan = md.build_model_3(specs, c, t, b, p_neighbor = p, solve = False)
+            plan.log_output = False
+            return solve_plan(plan, backend)
+        rebuild_time, cold = _best_time(rebuild, 1)
+        resolve_time, warm = _best_time(lambda: planner.set_pixel_weights(c + p * c_neighbor).solve(), 1)
+        rows.append({'p_neighbor': p,
+                     'rebuild_s': rebuild_time,
+                     'resolve_s': resolve_time,
+                     'speedup': rebuild_time / resolve_time,
+                     'rebuild_objective': cold.objective_value,
+                     'resolve_objective': warm.objective_value})
+    
+    return pd.DataFrame(rows)
+
+
+def compare_multires(folder = 'actualexample', models = ('build_model_3', 'build_model_4', 'build_model_5'), 
+                     factor = 2, backend = 'highs'):
+    """Time the coarse-to-fine solve against a direct full-resolution solve, with the objective gap"""
+    
+    from plan import solve_plan
+    from multires import solve_multires
+    specs = ld.get_specs(folder)
+    c, t, b = ld.load_data(folder, specs)
+    
+    rows = []
+    for name in models:
+        def direct():
+            plan = getattr(md, name)(specs, c, t, b, solve = False)
+            plan = plan[0] if isinstance(plan, tuple) else plan
+            plan.log_output = False
+            return solve_plan(plan, backend)
+        direct_time, full = _best_time(direct, 1)
+        multires_time, multi = _best_time(lambda: solve_multires(name, specs, c, t, b, factor, backend, 
+                                                                 log_output = False), 1)
+        multi = multi[0] if isinstance(multi, tuple) else multi
+        rows.append({'model': name,
+                     'direct_s': direct_time,
+                     'multires_s': multires_time,
+                     'speedup': direct_time / multires_time,
+                     'objective_gap': multi.objective_value - full.objective_value,
+                     'rounds': multi.rounds,
+                     'active_rows': sum(multi.active_rows),
+                     'full_rows': len(full.critical_slack) + len(full.tumor_surplus)})
+    
+    return pd.DataFrame(rows)
+
+
+def _stage(name, f):
+    """Run f() once as the instrument stage name and return its result with the wall time, CPU time,
+    and peak traced memory in MB"""
+    
+    # instrument.stage reports ru_maxrss, the process's high-water mark, which never falls between the
+    # stages of one suite; the traced peak is reset here, so it belongs to this stage alone
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        with stage(name) as info:
+            result = f()
+            info['traced_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+    
+    return result, {'wall_s': info['wall_s'], 'cpu_s': info['cpu_s'], 'peak_mb': info['traced_mb']}
+
+
+def benchmark_suite(sizes = ((20, 20, 20), (60, 60, 80), (126, 60, 80), (126, 120, 160)), 
+                    models = ('build_model_1', 'build_model_2', 'build_model_2_1', 'build_model_3', 
+                              'build_model_4', 'build_model_5'),
+                    backend = 'highs', output = 'benchmark_results.json', tumor_shape = 'ellipse', 
+                    critical_shape = 'ellipse', seed = 0):
+    """Time every stage of the pipeline on synthetic phantoms of each (beams, rows, cols) size
+    
+    Each row of the result is one stage on one size: get_specs, load_data (text and cache), each 
+    model's build and solve, and report_effectiveness. The rows and the environment are written 
+    to output as JSON, so runs on different commits can be compared."""
+    
+    from plan import solve_plan
+    from phantom import generate_phantom
+    import analytics as an
+    
+    rows = []
+    for num_beams, num_rows, num_cols in sizes:
+        folder = 'phantom_' + str(num_beams) + '_' + str(num_rows) + 'x' + str(num_cols)
+        generate_phantom(folder, num_beams, num_rows, num_cols, tumor_shape, critical_shape, seed = seed)
+        size = {'folder': folder, 'beams': num_beams, 'rows': num_rows, 'cols': num_cols}
+        
+        specs, stats = _stage('get_specs', lambda: ld.get_specs(folder, use_cache = False))
+        rows.append(dict(size, stage = 'get_specs', **stats))
+        _, stats = _stage('load_data_text', lambda: ld.load_data(folder, specs, use_cache = False))
+        rows.append(dict(size, stage = 'load_data_text', **stats))
+        ld.load_data(folder, specs)
+        (c, t, b), stats = _stage('load_data_cache', lambda: ld.load_data(folder, specs))
+        rows.append(dict(size, stage = 'load_data_cache', **stats))
+        
+        for name in models:
+            plan, stats = _stage(name + '.build', lambda: getattr(md, name)(specs, c, t, b, solve = False))
+            plan, t_model = plan if isinstance(plan, tuple) else (plan, t)
+            rows.append(dict(size, stage = name + '.build', model = name, 
+                             variables = len(plan.cost()), 
+                             constraints = len(plan.critical_rows) + len(plan.tumor_rows), **stats))
+            
+            plan.log_output = False
+            sol, stats = _stage(name + '.solve', lambda: solve_plan(plan, backend))
+            rows.append(dict(size, stage = name + '.solve', model = name, backend = backend,
+                             objective = sol.objective_value if sol else None, **stats))
+            
+            # An infeasible model has no plan to report on
+            if sol:
+                magnetic = name == 'build_model_5'
+                _, stats = _stage(name + '.report', lambda: an.report_effectiveness(sol, b, c, t_model, specs[3], 
+                                                                                    specs[4], plot = False, 
+                                                                                    magnetic = magnetic))
+                rows.append(dict(size, stage = name + '.report', model = name, **stats))
+    
+    results = pd.DataFrame(rows)
+    if output is not None:
+        env = {'python': sys.version.split()[0], 'numpy': np.__version__, 'platform': platform.platform(),
+               'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        with open(output, 'w') as f:
+            json.dump({'environment': env, 'results': json.loads(results.to_json(orient = 'records'))}, 
+                      f, indent = 1)
+    
+    return results
+
+
+if __name__ == '__main__':
+    print(compare_loaders())
+    print(compare_cache())
+    print(compare_assembly(('smallexample',)))
+    print(compare_assembly(('actualexample',), solve = False))
+    print(compare_backends())
+    print(compare_resolve())
+    print(compare_multires())
@@ -0,0 +1,107 @@
+import time
+import numpy as np
+from scipy import sparse
+
+import models as md
+from plan import PlanResult
+from instrument import stage
+
+# A solver-free preview of a plan. Every dose limit becomes a smooth penalty on its violation v:
+# up to the slack bound the plan's own slack cost on a Huber-rounded hinge, and past the bound (or
+# at once, for a region without slack) a quadratic with weight rho. Accelerated projected gradient
+# (FISTA, with x >= 0 as the projection) minimizes beam cost plus the penalties; each stage raises
+# rho and sharpens the hinge, so the intensities approach the LP optimum. The preview is a
+# PlanResult, so the analytics take it as is, and solve_plan(plan, start = preview) warm-starts
+# the exact solve from it.
+
+
+def _penalty_terms(plan):
+    """Return the region rows as one <= block A x <= limit, with each row's slack cost and bound"""
+    
+    n_c, n_t = len(plan.critical_rows), len(plan.tumor_rows)
+    A = sparse.vstack([plan.D.matrix[plan.critical_rows], -plan.D.matrix[plan.tumor_rows]], format = 'csr')
+    limit = np.concatenate((np.full(n_c, float(plan.max_dose)), np.full(n_t, -float(plan.min_dose))))
+    cost = np.concatenate((plan.critical_cost if plan.num_critical_slack else np.zeros(n_c),
+                           plan.tumor_cost if plan.num_tumor_surplus else np.zeros(n_t)))
+    
+    # A region without slack has bound 0, so all of its violation is penalized quadratically
+    bound = np.concatenate((np.full(n_c, 0.0 if not plan.num_critical_slack else
+                                    np.inf if plan.critical_ub is None else float(plan.critical_ub)),
+                            np.full(n_t, 0.0 if not plan.num_tumor_surplus else
+                                    np.inf if plan.tumor_ub is None else float(plan.tumor_ub))))
+    
+    return A, limit, cost, bound
+
+
+def _norm_squared(A, iterations = 30):
+    """Estimate the largest eigenvalue of A^T A by power iteration"""
+    
+    v, s = np.ones(A.shape[1]), 0.0
+    for i in range(0, iterations):
+        v = A.T @ (A @ v)
+        s = np.linalg.norm(v)
+        if s == 0:
+            break
+        v = v / s
+    
+    return s
+
+
+def solve_fluence(plan, stages = 6, iterations = 400, rho = 1.0, delta = 1.0, tol = 1e-7, x0 = None):
+    """Minimize the smoothed plan objective with accelerated projected gradient, returning a PlanResult
+    
+    Each of the stages runs up to iterations steps, then multiplies rho by 10 and divides the hinge
+    rounding delta by 3. The slack and surplus reported are those x implies, clipped to their bounds,
+    and objective_value is the plan objective at them; result.max_violation is what is left over."""
+    
+    start = time.perf_counter()
+    A, limit, cost, bound = _penalty_terms(plan)
+    AT = A.T.tocsr()
+    norm = _norm_squared(A)
+    x = np.zeros(plan.D.num_beams) if x0 is None else np.maximum(np.asarray(getattr(x0, 'x', x0), dtype = float), 0)
+    
+    steps = 0
+    for k in range(0, stages):
+        step = 1 / max((cost.max(initial = 0) / delta + rho) * norm, 1e-12)
+        y, t_k = x.copy(), 1.0
+        for i in range(0, iterations):
+            v = A @ y - limit
+            g = cost * np.clip(v / delta, 0, 1) + rho * np.maximum(v - bound, 0)
+            x_new = np.maximum(y - step * (plan.beam_cost + AT @ g), 0)
+            t_new = (1 + np.sqrt(1 + 4 * t_k * t_k)) / 2
+            
+            # Restart the momentum whenever it points against the last step
+            if np.dot(y - x_new, x_new - x) > 0:
+                y, t_new = x_new, 1.0
+            else:
+                y = x_new + (t_k - 1) / t_new * (x_new - x)
+            moved = np.linalg.norm(x_new - x)
+            x, t_k = x_new, t_new
+            steps += 1
+            if moved <= tol * max(1.0, np.linalg.norm(x)):
+                break
+        rho, delta = rho * 10, delta / 3
+    
+    v = A @ x - limit
+    slack = np.clip(v, 0, bound)
+    n_c = len(plan.critical_rows)
+    result = PlanResult(x, slack[:n_c][:plan.num_critical_slack], slack[n_c:][:plan.num_tumor_surplus],
+                        plan.beam_cost @ x + cost @ slack, 'numpy', time.perf_counter() - start,
+                        iterations = steps)
+    result.max_violation = float(np.maximum(v - bound, 0).max(initial = 0))
+    
+    return result
+
+
+def preview_model(model_name, specs, c, t, b, **params):
+    """Build a model and solve its preview; returns what the model returns, with the preview as the result"""
+    
+    plan = getattr(md, model_name)(specs, c, t, b, solve = False, **params)
+    plan, t_model = plan if isinstance(plan, tuple) else (plan, None)
+    with stage('preview', backend = 'numpy', **plan.stats()) as info:
+        result = solve_fluence(plan)
+        info['objective'], info['iterations'] = result.objective_value, result.iterations
+        info['max_violation'] = result.max_violation
+        info['message'] = 'Preview Solved.'
+    
+    return result if t_model is None else (result, t_model)
@@ -0,0 +1,56 @@
+import numpy as np
+from scipy import ndimage
+
+from load_data import array_key
+
+# Region masks memoized by (critical, tumor, margin, interior size), oldest evicted first
+_MASK_CACHE = {}
+_MASK_CACHE_SIZE = 16
+
+
+def margin(mask, width = 1):
+    """Return the pixels outside a region that lie within width pixels of it (chessboard distance)"""
+    
+    mask = np.asarray(mask) == 1
+    if not mask.any():
+        return np.zeros(mask.shape)
+    dist = ndimage.distance_transform_cdt(~mask, metric = 'chessboard')
+    
+    return ((dist > 0) & (dist <= width)).astype(float)
+
+
+def neighbor_ring(c, t, width = 1):
+    """Return the ring around the critical region, keeping critical pixels that lie inside the tumor;
+    masks with a slice axis get a ring in every direction"""
+    
+    c = np.asarray(c)
+    ring = ndimage.binary_dilation(c == 1, structure = np.ones((2 * width + 1,) * c.ndim))
+    
+    return ring.astype(float) - c * (np.asarray(t) == 0)
+
+
+def interior_core(t, size = 10):
+    """Return the interior of the tumor: the pixels whose size x size window (or cube, for masks with
+    a slice axis) holds the most tumor"""
+    
+    # uniform_filter gives the window mean in O(pixels); scaling and rounding recovers exact counts
+    t = np.asarray(t, dtype = float)
+    counts = np.rint(ndimage.uniform_filter(t, size, mode = 'constant') * size ** t.ndim)
+    
+    return (counts == counts.max()).astype(float)
+
+
+def region_masks(c, t, margin_width = 1, interior_size = 10):
+    """Return the critical neighbor ring and tumor interior for a dataset, computed once per input"""
+    
+    key = (array_key(c, t), margin_width, interior_size)
+    if key not in _MASK_CACHE:
+        if len(_MASK_CACHE) >= _MASK_CACHE_SIZE:
+            del _MASK_CACHE[next(iter(_MASK_CACHE))]
+        masks = {'c_neighbor': neighbor_ring(c, t, margin_width), 
+                 'tr': interior_core(t, interior_size)}
+        for m in masks.values():
+            m.flags.writeable = False
+        _MASK_CACHE[key] = masks
+        
+    return _MASK_CACHE[key]
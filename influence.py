@@ -0,0 +1,71 @@
+import numpy as np
+from scipy import sparse
+
+
+class DoseInfluence():
+    """Sparse (pixels x beams) dose-influence matrix, with the row sets of each region"""
+    
+    def __init__(self, b, c = None, t = None):
+        b = np.asarray(b)
+        self.num_beams = b.shape[0]
+        self.grid_shape = b.shape[1:]
+        self.num_pixels = int(np.prod(self.grid_shape))
+        
+        # Row j * cols + k, column i holds b[i][j,k]; only the non-zero entries are stored
+        i, j, k = np.nonzero(b)
+        self.matrix = sparse.csr_matrix((b[i, j, k], (j * self.grid_shape[1] + k, i)),
+                                        shape = (self.num_pixels, self.num_beams))
+        
+        self.critical_rows = self.rows(c) if c is not None else None
+        self.tumor_rows = self.rows(t) if t is not None else None
+        
+    @classmethod
+    def from_matrix(cls, matrix, grid_shape):
+        """Wrap an existing (pixels x beams) sparse matrix, such as a column subset of another influence"""
+        
+        D = cls.__new__(cls)
+        D.matrix = sparse.csr_matrix(matrix)
+        D.num_pixels, D.num_beams = D.matrix.shape
+        D.grid_shape = tuple(grid_shape)
+        D.critical_rows, D.tumor_rows = None, None
+        
+        return D
+    
+    def rows(self, mask):
+        """Return the flattened pixel indices where a region mask is set"""
+        
+        return np.flatnonzero(np.asarray(mask).ravel() == 1)
+    
+    def row_beams(self, r):
+        """Return the beams that reach pixel row r and their dose coefficients"""
+        
+        lo, hi = self.matrix.indptr[r], self.matrix.indptr[r + 1]
+        return self.matrix.indices[lo:hi], self.matrix.data[lo:hi]
+    
+    def beam_weights(self, weights):
+        """Return, per beam, the total dose weighted by a per-pixel weight map"""
+        
+        return self.matrix.T @ np.asarray(weights, dtype = float).ravel()
+    
+    def dose(self, x):
+        """Return the dose map delivered by the beam intensities x"""
+        
+        return (self.matrix @ np.asarray(x, dtype = float)).reshape(self.grid_shape)
+
+
+
+def as_influence(b, c = None, t = None):
+    """Return b if it is already a DoseInfluence, otherwise build one from the beam maps; the row sets
+    always come from the masks given, so an influence built for other masks is never reused as is"""
+    
+    if isinstance(b, DoseInfluence):
+        if c is None and t is None:
+            return b
+        
+        # A view sharing the matrix, so the caller's influence keeps its own row sets
+        D = DoseInfluence.from_matrix(b.matrix, b.grid_shape)
+        D.critical_rows = D.rows(c) if c is not None else b.critical_rows
+        D.tumor_rows = D.rows(t) if t is not None else b.tumor_rows
+        return D
+    
+    return DoseInfluence(b, c, t)
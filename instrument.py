@@ -0,0 +1,100 @@
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+# Every stage of the pipeline reports through emit() as a structured event: a dict with the event
+# name, a timestamp, the stage's fields, and an optional human-readable message. The sink decides
+# what happens to it. By default messages are printed as before, set_sink(JsonSink(path)) writes
+# one JSON object per line, and set_sink(None) discards everything.
+
+
+class ConsoleSink():
+    """Print the message of each event, as the pipeline always has"""
+    
+    def __call__(self, event):
+        if event.get('message') is not None:
+            print(event['message'])
+
+
+class JsonSink():
+    """Write each event as one line of JSON to a path or an open stream"""
+    
+    def __init__(self, target = None):
+        self.target = sys.stdout if target is None else target
+    
+    def __call__(self, event):
+        line = json.dumps(event, default = str) + '\n'
+        if isinstance(self.target, str):
+            with open(self.target, 'a') as f:
+                f.write(line)
+        else:
+            self.target.write(line)
+
+
+class ListSink():
+    """Keep every event in a list, for inspecting a run afterwards"""
+    
+    def __init__(self):
+        self.events = []
+    
+    def __call__(self, event):
+        self.events.append(event)
+    
+    def frame(self):
+        """Return the events as a DataFrame"""
+    
+        import pandas as pd
+        return pd.DataFrame(self.events)
+
+
+_SINK = [ConsoleSink()]
+
+
+def set_sink(sink):
+    """Send events to sink, any callable taking an event dict; None discards them. Returns the old sink"""
+    
+    old, _SINK[0] = _SINK[0], sink
+    
+    return old
+
+
+def emit(event, message = None, **fields):
+    """Send a structured event to the current sink"""
+    
+    sink = _SINK[0]
+    if sink is None:
+        return None
+    record = {'event': event, 'time': time.time()}
+    record.update(fields)
+    if message is not None:
+        record['message'] = message
+    sink(record)
+    
+    return None
+
+
+def peak_memory_mb():
+    """Return the peak resident memory of the process so far in MB"""
+    
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+    
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+@contextmanager
+def stage(name, **fields):
+    """Time a block of the pipeline and emit one event for it with wall and CPU time and peak memory;
+    the yielded dict can be filled with more fields, such as counts, before the block ends"""
+    
+    info = dict(fields)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield info
+    finally:
+        info['wall_s'] = time.perf_counter() - wall
+        info['cpu_s'] = time.process_time() - cpu
+        info['peak_mb'] = peak_memory_mb()
+        emit(name, **info)
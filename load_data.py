@@ -1,38 +1,152 @@
+import os
+import json
+import hashlib
 import numpy as np
 import pandas as pd
 import regex as re
 
-def get_specs(folder_name):
+from instrument import emit, stage
+
+SOURCE_FILES = ('specs.txt', 'critical_raw.txt', 'tumor_raw.txt', 'beam_raw.txt')
+CACHE_DIR = '.cache'
+
+
+def _source_stamps(folder_name, known = None):
+    """Return the mtime, size, and hash of each source file, hashing only files that look changed"""
+    
+    stamps = {}
+    for name in SOURCE_FILES:
+        path = 'task/task/' + folder_name + '/' + name
+        st = os.stat(path)
+        stamp = {'mtime': st.st_mtime_ns, 'size': st.st_size}
+        if known is not None and name in known \
+           and known[name]['mtime'] == stamp['mtime'] and known[name]['size'] == stamp['size']:
+            stamp['sha1'] = known[name]['sha1']
+        else:
+            with open(path, 'rb') as f:
+                stamp['sha1'] = hashlib.sha1(f.read()).hexdigest()
+        stamps[name] = stamp
+        
+    return stamps
+
+
+def array_key(*arrays):
+    """Identify a set of arrays by their shapes, dtypes, and contents"""
+    
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(str((a.shape, a.dtype.str)).encode())
+        h.update(a.view(np.uint8))
+        
+    return h.hexdigest()
+
+
+def _read_manifest(folder_name):
+    """Return the cache manifest if it is still valid for the source files, otherwise None"""
+    
+    path = 'task/task/' + folder_name + '/' + CACHE_DIR + '/manifest.json'
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    # Touched but unchanged files still hash the same, so only the content decides; a manifest
+    # missing any entry is stale
+    try:
+        stamps = _source_stamps(folder_name, manifest['sources'])
+        if any(stamps[name]['sha1'] != manifest['sources'][name]['sha1'] for name in SOURCE_FILES):
+            return None
+        manifest['specs'], manifest['spec_lines']
+    except (KeyError, TypeError):
+        return None
+    manifest['sources'] = stamps
+    
+    return manifest
+
+
+def _write_cache(folder_name, spec_lines, specs, critical, tumor, beams):
+    """Write the parsed arrays as .npy files so later loads can memory-map them"""
+    
+    cache = 'task/task/' + folder_name + '/' + CACHE_DIR + '/'
+    os.makedirs(cache, exist_ok = True)
+    
+    # Write to a private temp name and rename, so concurrent workers never see half a file
+    tag = '.' + str(os.getpid()) + '.tmp'
+    for name, array in (('critical', critical), ('tumor', tumor), ('beams', beams)):
+        np.save(cache + name + tag + '.npy', np.ascontiguousarray(array))
+        os.replace(cache + name + tag + '.npy', cache + name + '.npy')
+    manifest = {'spec_lines': spec_lines, 'specs': specs, 'sources': _source_stamps(folder_name)}
+    with open(cache + 'manifest' + tag, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(cache + 'manifest' + tag, cache + 'manifest.json')
+    
+    return None
+
+
+def get_specs(folder_name, use_cache = True):
     """Returns the specs of the data given a folder name"""
     
+    manifest = _read_manifest(folder_name) if use_cache else None
+    if manifest is not None:
+        l = list(manifest['specs'])
+        emit('specs', folder = folder_name, specs = l, message = '\n'.join(manifest['spec_lines'] + ['']))
+        return l
+    
     f = open('task/task/' + folder_name + '/specs.txt')
-    l = []
+    l, lines = [], []
     
     for _ in range(0, 5):
         line = f.readline().replace('\n', '')
-        print(line)
+        lines.append(line)
         l.append(int(re.sub("[^0-9]", "", line)))
-    print('')
+    emit('specs', folder = folder_name, specs = l, message = '\n'.join(lines + ['']))
     
     return l
 
-def load_data(folder_name, specs):
+def load_beams(folder_name, specs):
+    """Load every beam map in a single pass over beam_raw.txt"""
+    
+    # Blank separator lines are skipped by the tokenizer, so the file is one block of rows
+    raw = np.loadtxt('task/task/' + folder_name + '/beam_raw.txt', ndmin = 2)
+    if raw.shape != (specs[0] * specs[1], specs[2]):
+        raise ValueError('beam_raw.txt has shape ' + str(raw.shape) + ', expected ' 
+                         + str((specs[0] * specs[1], specs[2])))
+    
+    # The parsed rows are already contiguous, so this is a view rather than a copy
+    return raw.reshape(specs[0], specs[1], specs[2])
+
+def load_data(folder_name, specs, use_cache = True):
     """Given the specifications, load the critical, tumor, and beam maps"""
     
-    # Load the critical and tumor map
-    critical = np.loadtxt('task/task/' + folder_name + '/critical_raw.txt')
-    print('Map Loaded: Critical')
-    tumor = np.loadtxt('task/task/' + folder_name + '/tumor_raw.txt')
-    print('Map Loaded: Tumor')
-    
-    # Load the beam map for each beam
-    beams, first, last = [], 0, specs[1]
-    for i in range(0, specs[0]):
-        beam = np.loadtxt('task/task/' + folder_name + '/beam_raw.txt', 
-                          skiprows = first,
-                          max_rows = last)
-        beams.append(beam)
-        first = first + specs[1] + 1
-    print('Map Loaded: Beams')
+    with stage('load_data', folder = folder_name) as info:
+        # Memory-map the compiled arrays if the source files have not changed since they were written
+        manifest = _read_manifest(folder_name) if use_cache else None
+        if manifest is not None and list(manifest['specs']) == list(specs):
+            cache = 'task/task/' + folder_name + '/' + CACHE_DIR + '/'
+            critical = np.load(cache + 'critical.npy', mmap_mode = 'r')
+            tumor = np.load(cache + 'tumor.npy', mmap_mode = 'r')
+            beams = np.load(cache + 'beams.npy', mmap_mode = 'r')
+            info.update(source = 'cache', message = 'Maps Loaded: Cache')
+            return critical, tumor, beams
+        
+        # Load the critical and tumor map
+        critical = np.loadtxt('task/task/' + folder_name + '/critical_raw.txt')
+        emit('map_loaded', folder = folder_name, map = 'critical', message = 'Map Loaded: Critical')
+        tumor = np.loadtxt('task/task/' + folder_name + '/tumor_raw.txt')
+        emit('map_loaded', folder = folder_name, map = 'tumor', message = 'Map Loaded: Tumor')
+        
+        # Load the beam map for each beam, indexed as beams[i][j,k]
+        beams = load_beams(folder_name, specs)
+        emit('map_loaded', folder = folder_name, map = 'beams', message = 'Map Loaded: Beams')
+        info['source'] = 'text'
+        
+        if use_cache:
+            # Only cache arrays that were loaded with the folder's own specs
+            with open('task/task/' + folder_name + '/specs.txt') as f:
+                spec_lines = [f.readline().replace('\n', '') for _ in range(0, 5)]
+            if [int(re.sub("[^0-9]", "", line)) for line in spec_lines] == list(specs):
+                _write_cache(folder_name, spec_lines, list(specs), critical, tumor, beams)
         
-    return critical, tumor, beams
\ No newline at end of file
+    return critical, tumor, beams
@@ -0,0 +1,45 @@
+import numpy as np
+
+from load_data import array_key
+
+# Shifted beam tensors memoized by (beam data, intensity, direction), oldest evicted first
+_SHIFT_CACHE = {}
+_SHIFT_CACHE_SIZE = 8
+
+
+def row_shifts(num_beams, rows, intensity = 0.75):
+    """Return how far each row is deflected by a field of the given intensity"""
+    
+    # The split point follows the original shift loops, which compare the row against half the beam count
+    r = np.arange(0, rows)
+    return np.where(r < num_beams / 2, r ** intensity, (rows - r) ** intensity).astype(int)
+
+
+def shift_beams(b, intensity = 0.75, direction = 1):
+    """Roll every row of every beam by its deflection in one gather; direction -1 is left, 1 is right"""
+    
+    b = np.asarray(b)
+    num_beams, rows, cols = b.shape
+    shifts = direction * row_shifts(num_beams, rows, intensity)
+    
+    # Same as np.roll(b[i][j], shifts[j]) for every beam i and row j
+    idx = (np.arange(0, cols)[None, :] - shifts[:, None]) % cols
+    return np.take_along_axis(b, np.broadcast_to(idx, b.shape), axis = 2)
+
+
+def magnetic_beams(b, intensity = 0.75, directions = (-1, 1)):
+    """Return the shifted beam tensors for each field direction, memoized per dataset and intensity"""
+    
+    key = array_key(b)
+    shifted = []
+    for direction in directions:
+        k = (key, float(intensity), direction)
+        if k not in _SHIFT_CACHE:
+            if len(_SHIFT_CACHE) >= _SHIFT_CACHE_SIZE:
+                del _SHIFT_CACHE[next(iter(_SHIFT_CACHE))]
+            beams = shift_beams(b, intensity, direction)
+            beams.flags.writeable = False
+            _SHIFT_CACHE[k] = beams
+        shifted.append(_SHIFT_CACHE[k])
+        
+    return tuple(shifted)
@@ -1,399 +1,169 @@
 import pandas as pd
 import numpy as np
 from matplotlib import pyplot as plt
-from docplex.mp.model import Model
 
+from influence import as_influence
+from geometry import region_masks
+from magnetic import magnetic_beams
+from plan import PlanLP, solve_plan
+from instrument import emit, stage
 
-def build_model_1(specs, c, t, b):
-    model = Model(name = 'm1')
-    
-    # Create ranges
-    beam_range, vert_range, hori_range = range(0, specs[0]), range(0, specs[1]), range(0, specs[2])
-    idx = [(i, j, k) for i in beam_range for j in vert_range for k in hori_range]
-    
-    # Add beam intensity variables and make non-negative
-    x = model.continuous_var_list(keys=specs[0])
-    for i in range(0, specs[0]):
-        model.add_constraint(x[i] >= 0)
-    print('Intensity variables added.')
-        
-    # Add beam intensity variables in (j,k) given beam (i)
-    for j in vert_range:
-        for k in hori_range:
-            if c[j,k] == 1:
-                if sum(b[i][j,k] for i in beam_range) == 0:
-                    print('CRITICAL ERROR FOR', j, k)
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) <= specs[3])
-            if t[j,k] == 1:
-                if sum(b[i][j,k] for i in beam_range) == 0:
-                    print('TUMOR ERROR FOR', j, k)
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) >= specs[4])
-    print('Intensity constraints added.')
-    
-    # Objective Function
-    obj = model.objective_expr
-    for j in vert_range:
-        for k in hori_range:
-            obj += sum(x[i] * b[i][j,k] * (c[j,k] - t[j,k]) for i in beam_range)
-    print('Object Function Constructed.')
-    print(obj)
-    
-    model.minimize(obj)
-    model.export_as_lp("test.lp")
-    print('Model Exported.')
-    
-    model.print_information()
-    solution = model.solve()
-    if solution != None:
-        print('Model Solved.')
-    else:
-        print('ERROR: NO SOLUTION')
-    
-    return solution
-
+# Every build_model_* lowers its problem to a PlanLP and solves it with the chosen backend:
+# 'cplex' through docplex, or 'highs' through scipy.optimize.linprog. With presolve = True
+# the plan is reduced before solving and its solution expanded back. With lazy = True the
+# critical rows are generated only as they are violated (active_set.solve_lazy). A start (such as a
+# fluence.preview_model result) warm-starts the exact solve. With solve = False
+# the PlanLP is returned instead, and plan.to_docplex() or plan.to_arrays() gives the model;
+# export_plan(plan, 'test.lp') in plan.py writes it out. Progress is reported through instrument.emit.
+# Construction runs as the instrument.stage 'build', so it is timed like the load and solve stages.
 
 
-def build_model_2(specs, c, t, b):
-    model = Model(name = 'm2', log_output=True)
-    
-    # Create ranges
-    beam_range, vert_range, hori_range = range(0, specs[0]), range(0, specs[1]), range(0, specs[2])
+def build_model_1(specs, c, t, b, D = None, solve = True, backend = 'cplex', presolve = False, lazy = False, 
+                  start = None):
     
-    # Add beam intensity variables and make non-negative
-    x = model.continuous_var_list(keys=specs[0])
-    for i in range(0, specs[0]):
-        model.add_constraint(x[i] >= 0)
-    print('Intensity variables added.')
-    
-    # Add slack and surplus variables to allow for flexibility with critical and tumor regions
-    c_x = model.continuous_var_list(keys=[('critical_slack', j, k) for j in vert_range for k in hori_range])
-    for i in range(0, len(c_x)):
-        model.add_constraint(c_x[i] >= 0)
-        model.add_constraint(c_x[i] <= 2)
-    s_x = model.continuous_var_list(keys=[('tumor_surplus', j, k) for j in vert_range for k in hori_range])
-    for i in range(0, len(s_x)):
-        model.add_constraint(s_x[i] >= 0)
-        model.add_constraint(s_x[i] <= 10)
-
-    # Add constraints given beam intensity variables, regions, and slack/surplus variables
-    for j in vert_range:
-        for k in hori_range:
-            if c[j,k] == 1:
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) - c_x[j * specs[2] + k] <= specs[3])
-            if t[j,k] == 1:
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) + s_x[j * specs[2] + k] >= specs[4])
-    print('Intensity constraints added.')
+    with stage('build') as info:
+        # Build the sparse dose-influence matrix unless one was passed in
+        D = as_influence(b if D is None else D, c, t)
         
-    # Objective Function
-    obj = model.objective_expr
-    for j in vert_range:
-        for k in hori_range:
-            obj += sum(x[i] * b[i][j,k] * c[j,k] for i in beam_range)
-    print('Object Function Constructed.')
-    
-    model.minimize(obj)
-    model.export_as_lp("test.lp")
-    
-    print('Model Exported.')
-    
-    model.print_information()
-    solution = model.solve()
-    if solution != None:
-        print('Model Solved.')
-    else:
-        print('ERROR: NO SOLUTION')
+        # Flag any region pixel that no beam reaches
+        beam_count = np.diff(D.matrix.indptr)
+        for r in D.critical_rows[beam_count[D.critical_rows] == 0]:
+            emit('unreached_pixel', region = 'critical', row = int(r // specs[2]), col = int(r % specs[2]),
+                 message = 'CRITICAL ERROR FOR ' + str(r // specs[2]) + ' ' + str(r % specs[2]))
+        for r in D.tumor_rows[beam_count[D.tumor_rows] == 0]:
+            emit('unreached_pixel', region = 'tumor', row = int(r // specs[2]), col = int(r % specs[2]),
+                 message = 'TUMOR ERROR FOR ' + str(r // specs[2]) + ' ' + str(r % specs[2]))
+        
+        # Hard dose limits on every critical and tumor pixel, minimizing critical minus tumor dose
+        plan = PlanLP('m1', D, D.critical_rows, D.tumor_rows, specs[3], specs[4], 
+                      D.beam_weights(c - t), log_output = False)
+        info.update(plan.stats())
+        info['message'] = 'Model Constructed.'
+    if not solve:
+        return plan
     
-    return solution
+    return solve_plan(plan, backend, presolve, lazy = lazy, start = start)
 
 
 
-def build_model_2_1(specs, c, t, b):
-    model = Model(name = 'm1', log_output=True)
+def build_model_2(specs, c, t, b, D = None, solve = True, backend = 'cplex', presolve = False, lazy = False, 
+                  start = None):
     
-    # Create ranges
-    beam_range, vert_range, hori_range = range(0, specs[0]), range(0, specs[1]), range(0, specs[2])
-    
-    # Add beam intensity variables and make non-negative
-    x = model.continuous_var_list(keys=specs[0])
-    for i in range(0, specs[0]):
-        model.add_constraint(x[i] >= 0)
-    print('Intensity variables added.')
-    
-    # Add slack and surplus variables to allow for flexibility with critical and tumor regions
-    c_x = model.continuous_var_list(keys=[('critical_slack', j, k) for j in vert_range for k in hori_range])
-    for i in range(0, len(c_x)):
-        model.add_constraint(c_x[i] >= 0)
-        model.add_constraint(c_x[i] <= 10)
-    s_x = model.continuous_var_list(keys=[('tumor_surplus', j, k) for j in vert_range for k in hori_range])
-    for i in range(0, len(s_x)):
-        model.add_constraint(s_x[i] >= 0)
-        model.add_constraint(s_x[i] <= 10)
-
-    # Add constraints given beam intensity variables, regions, and slack/surplus variables
-    for j in vert_range:
-        for k in hori_range:
-            if c[j,k] == 1:
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) - c_x[j * specs[2] + k] <= specs[3])
-            if t[j,k] == 1:
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) + s_x[j * specs[2] + k] >= specs[4])
-    print('Intensity constraints added.')
+    with stage('build') as info:
+        # Build the sparse dose-influence matrix unless one was passed in
+        D = as_influence(b if D is None else D, c, t)
         
-    # Objective Function
-    obj = model.objective_expr
-    for j in vert_range:
-        for k in hori_range:
-            obj += sum(x[i] * b[i][j,k] * c[j,k] for i in beam_range) \
-                + c_x[j * specs[2] + k] * c[j,k] \
-                + s_x[j * specs[2] + k] * t[j,k]
-    print('Object Function Constructed.')
+        # Slack and surplus variables allow for flexibility with critical and tumor regions, at no cost
+        plan = PlanLP('m2', D, D.critical_rows, D.tumor_rows, specs[3], specs[4], 
+                      D.beam_weights(c), critical_ub = 2, tumor_ub = 10)
+        info.update(plan.stats())
+        info['message'] = 'Model Constructed.'
+    if not solve:
+        return plan
     
-    model.minimize(obj)
-    model.export_as_lp("test.lp")
-    
-    print('Model Exported.')
-    
-    model.print_information()
-    solution = model.solve()
-    if solution != None:
-        print('Model Solved.')
-    else:
-        print('ERROR: NO SOLUTION')
-    
-    return solution
+    return solve_plan(plan, backend, presolve, lazy = lazy, start = start)
 
 
 
-def build_model_3(specs, c, t, b, p_neighbor = 0.5):
-    model = Model(name = 'm1', log_output=True)
-    
-    # Create ranges
-    beam_range, vert_range, hori_range = range(0, specs[0]), range(0, specs[1]), range(0, specs[2])
-    
-    # Create critical neighbor map
-    from scipy import ndimage
-    c_neighbor = ndimage.generic_filter(c, np.nanmean, size = 3, mode='constant', cval=0)
-    c_neighbor[c_neighbor > 0] = 1
-    for j in vert_range:
-        for k in hori_range:
-            if t[j,k] == 0:
-                c_neighbor[j,k] = c_neighbor[j,k] - c[j,k]
-            
-    # Add beam intensity variables and make non-negative
-    x = model.continuous_var_list(keys=specs[0])
-    for i in range(0, specs[0]):
-        model.add_constraint(x[i] >= 0)
-    print('Intensity variables added.')
+def build_model_2_1(specs, c, t, b, D = None, solve = True, backend = 'cplex', presolve = False, lazy = False, 
+                  start = None):
     
-    # Add slack and surplus variables to allow for flexibility with critical and tumor regions
-    c_x = model.continuous_var_list(keys=[('critical_slack', j, k) for j in vert_range for k in hori_range])
-    for i in range(0, len(c_x)):
-        model.add_constraint(c_x[i] >= 0)
-        model.add_constraint(c_x[i] <= 1)
-    s_x = model.continuous_var_list(keys=[('tumor_surplus', j, k) for j in vert_range for k in hori_range])
-    for i in range(0, len(s_x)):
-        model.add_constraint(s_x[i] >= 0)
-        model.add_constraint(s_x[i] <= 20)
-
-    # Add constraints given beam intensity variables, regions, and slack/surplus variables
-    for j in vert_range:
-        for k in hori_range:
-            if c[j,k] == 1:
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) - c_x[j * specs[2] + k] <= specs[3])
-            if t[j,k] == 1:
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) + s_x[j * specs[2] + k] >= specs[4])
-    print('Intensity constraints added.')
+    with stage('build') as info:
+        # Build the sparse dose-influence matrix unless one was passed in
+        D = as_influence(b if D is None else D, c, t)
         
-    # Objective Function
-    obj = model.objective_expr
-    for j in vert_range:
-        for k in hori_range:
-            obj += sum(x[i] * b[i][j,k] * (c[j,k] + p_neighbor * c_neighbor[j,k]) for i in beam_range) \
-                + c_x[j * specs[2] + k] * c[j,k] \
-                + s_x[j * specs[2] + k] * t[j,k]
-    print('Object Function Constructed.')
-    
-    model.minimize(obj)
-    model.export_as_lp("test.lp")
-    
-    print('Model Exported.')
+        # Slack and surplus variables allow for flexibility with critical and tumor regions, at unit cost
+        plan = PlanLP('m1', D, D.critical_rows, D.tumor_rows, specs[3], specs[4], 
+                      D.beam_weights(c),
+                      critical_cost = c.ravel()[D.critical_rows], 
+                      tumor_cost = t.ravel()[D.tumor_rows], 
+                      critical_ub = 10, tumor_ub = 10)
+        info.update(plan.stats())
+        info['message'] = 'Model Constructed.'
+    if not solve:
+        return plan
     
-    model.print_information()
-    solution = model.solve()
-    if solution != None:
-        print('Model Solved.')
-    else:
-        print('ERROR: NO SOLUTION')
-    
-    return solution
+    return solve_plan(plan, backend, presolve, lazy = lazy, start = start)
 
 
-def build_model_4(specs, c, t, b, p_neighbor = 0.5, p_regrow = 0.1):
-    model = Model(name = 'm1', log_output=True)
-    
-    # Create ranges
-    beam_range, vert_range, hori_range = range(0, specs[0]), range(0, specs[1]), range(0, specs[2])
-    
-    # Create critical neighbor map
-    from scipy import ndimage
-    c_neighbor = ndimage.generic_filter(c, np.nanmean, size = 3, mode='constant', cval=0)
-    c_neighbor[c_neighbor > 0] = 1
-    for j in vert_range:
-        for k in hori_range:
-            if t[j,k] == 0:
-                c_neighbor[j,k] = c_neighbor[j,k] - c[j,k]
-                
-    # Slice out the interior of the tumor
-    tr = ndimage.generic_filter(t, np.nansum, size = 10, mode='constant', cval=0)
-    tr[tr != np.max(tr)] = 0
-    tr[tr == np.max(tr)] = 1
-    t = t - tr
-            
-    # Add beam intensity variables and make non-negative
-    x = model.continuous_var_list(keys=specs[0])
-    for i in range(0, specs[0]):
-        model.add_constraint(x[i] >= 0)
-    print('Intensity variables added.')
-    
-    # Add slack and surplus variables to allow for flexibility with critical and tumor regions
-    c_x = model.continuous_var_list(keys=[('critical_slack', j, k) for j in vert_range for k in hori_range])
-    for i in range(0, len(c_x)):
-        model.add_constraint(c_x[i] >= 0)
-        #model.add_constraint(c_x[i] <= 1)
-    s_x = model.continuous_var_list(keys=[('tumor_surplus', j, k) for j in vert_range for k in hori_range])
-    for i in range(0, len(s_x)):
-        model.add_constraint(s_x[i] >= 0)
-        model.add_constraint(s_x[i] <= 20)
 
-    # Add constraints given beam intensity variables, regions, and slack/surplus variables
-    for j in vert_range:
-        for k in hori_range:
-            if c[j,k] == 1:
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) - c_x[j * specs[2] + k] <= specs[3])
-            if t[j,k] == 1:
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) + s_x[j * specs[2] + k] >= specs[4])
-    print('Intensity constraints added.')
-        
-    # Objective Function
-    obj = model.objective_expr
-    for j in vert_range:
-        for k in hori_range:
-            obj += sum(x[i] * b[i][j,k] * (c[j,k] + p_neighbor * c_neighbor[j,k]) for i in beam_range) \
-                + c_x[j * specs[2] + k] * c[j,k] \
-                + s_x[j * specs[2] + k] * (t[j,k] + tr[j,k] * p_regrow)
-    print('Object Function Constructed.')
-    
-    model.minimize(obj)
-    model.export_as_lp("test.lp")
+def build_model_3(specs, c, t, b, p_neighbor = 0.5, margin_width = 1, D = None, solve = True, backend = 'cplex', presolve = False, lazy = False, 
+                  start = None):
     
-    print('Model Exported.')
-    
-    model.print_information()
-    solution = model.solve()
-    if solution != None:
-        print('Model Solved.')
-    else:
-        print('ERROR: NO SOLUTION')
+    with stage('build') as info:
+        # Build the sparse dose-influence matrix unless one was passed in
+        D = as_influence(b if D is None else D, c, t)
+        
+        # Create critical neighbor map
+        c_neighbor = region_masks(c, t, margin_width)['c_neighbor']
+        
+        # Dose next to the critical region is penalized as well
+        plan = PlanLP('m1', D, D.critical_rows, D.tumor_rows, specs[3], specs[4], 
+                      D.beam_weights(c + p_neighbor * c_neighbor),
+                      critical_cost = c.ravel()[D.critical_rows], 
+                      tumor_cost = t.ravel()[D.tumor_rows], 
+                      critical_ub = 1, tumor_ub = 20)
+        info.update(plan.stats())
+        info['message'] = 'Model Constructed.'
+    if not solve:
+        return plan
+    
+    return solve_plan(plan, backend, presolve, lazy = lazy, start = start)
+
+
+def build_model_4(specs, c, t, b, p_neighbor = 0.5, p_regrow = 0.1, margin_width = 1, interior_size = 10, 
+                  D = None, solve = True, backend = 'cplex', presolve = False, lazy = False, start = None):
+    
+    with stage('build') as info:
+        # Create critical neighbor map and slice out the interior of the tumor
+        masks = region_masks(c, t, margin_width, interior_size)
+        c_neighbor, tr = masks['c_neighbor'], masks['tr']
+        t = t - tr
+        
+        # Build the sparse dose-influence matrix unless one was passed in; the tumor rows exclude the interior
+        D = as_influence(b if D is None else D, c)
+        tumor_rows = D.rows(t)
+        
+        # Critical slack is unbounded; tumor surplus is weighted up for regrowth
+        plan = PlanLP('m1', D, D.critical_rows, tumor_rows, specs[3], specs[4], 
+                      D.beam_weights(c + p_neighbor * c_neighbor),
+                      critical_cost = c.ravel()[D.critical_rows], 
+                      tumor_cost = (t + tr * p_regrow).ravel()[tumor_rows], 
+                      critical_ub = None, tumor_ub = 20)
+        info.update(plan.stats())
+        info['message'] = 'Model Constructed.'
+    if not solve:
+        return plan, t
     
-    return solution, t
+    return solve_plan(plan, backend, presolve, lazy = lazy, start = start), t
 
 
 
-def build_model_5(specs, c, t, b, p_neighbor = 0.5, p_regrow = 0.1, intensity = 0.75):
-    model = Model(name = 'm1', log_output=True)
-    
-    # Create ranges
-    beam_range, vert_range, hori_range = range(0, specs[0]), range(0, specs[1]), range(0, specs[2])
+def build_model_5(specs, c, t, b, p_neighbor = 0.5, p_regrow = 0.1, intensity = 0.75, margin_width = 1, interior_size = 10, 
+                  D = None, solve = True, backend = 'cplex', presolve = False, lazy = False, start = None):
     
-    # Create critical neighbor map
-    from scipy import ndimage
-    c_neighbor = ndimage.generic_filter(c, np.nanmean, size = 3, mode='constant', cval=0)
-    c_neighbor[c_neighbor > 0] = 1
-    for j in vert_range:
-        for k in hori_range:
-            if t[j,k] == 0:
-                c_neighbor[j,k] = c_neighbor[j,k] - c[j,k]
-                
-    # Slice out the interior of the tumor
-    tr = ndimage.generic_filter(t, np.nansum, size = 10, mode='constant', cval=0)
-    tr[tr != np.max(tr)] = 0
-    tr[tr == np.max(tr)] = 1
-    t = t - tr
-    
-    # Add two magnetic fields
-    left_b, right_b = np.copy(b), np.copy(b)
-    for beam in range(0, len(left_b)):
-        intensity = 0.75
-        for _ in range(0, len(left_b[beam])):
-            if _ < len(left_b)/2:
-                left_b[beam][_] = np.roll(left_b[beam][_],-int(_**intensity))
-            else:
-                left_b[beam][_] = np.roll(left_b[beam][_],-int((len(left_b[beam])-_)**intensity))
-    for beam in range(0, len(right_b)):
-        intensity = 0.75
-        for _ in range(0, len(right_b[beam])):
-            if _ < len(right_b)/2:
-                right_b[beam][_] = np.roll(right_b[beam][_],int(_**intensity))
-            else:
-                right_b[beam][_] = np.roll(right_b[beam][_],int((len(right_b[beam])-_)**intensity))
-                
-    # Add beam intensity variables and make non-negative
-    x = model.continuous_var_list(keys=specs[0])
-    for i in range(0, specs[0]):
-        model.add_constraint(x[i] >= 0)
-    x_l = model.continuous_var_list(keys=specs[0])
-    for i in range(0, specs[0]):
-        model.add_constraint(x_l[i] >= 0)
-    x_r = model.continuous_var_list(keys=specs[0])
-    for i in range(0, specs[0]):
-        model.add_constraint(x_r[i] >= 0)
-    print('Intensity variables added.')
-    
-    # Add slack and surplus variables to allow for flexibility with critical and tumor regions
-    c_x = model.continuous_var_list(keys=[('critical_slack', j, k) for j in vert_range for k in hori_range])
-    for i in range(0, len(c_x)):
-        model.add_constraint(c_x[i] >= 0)
-        model.add_constraint(c_x[i] <= 2)
-    s_x = model.continuous_var_list(keys=[('tumor_surplus', j, k) for j in vert_range for k in hori_range])
-    for i in range(0, len(s_x)):
-        model.add_constraint(s_x[i] >= 0)
-        model.add_constraint(s_x[i] <= 20)
-
-    # Add constraints given beam intensity variables, regions, and slack/surplus variables
-    for j in vert_range:
-        for k in hori_range:
-            if c[j,k] == 1:
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) \
-                                   + model.sum(x_l[i] * left_b[i][j,k] for i in beam_range) \
-                                   + model.sum(x_r[i] * right_b[i][j,k] for i in beam_range) \
-                                   - c_x[j * specs[2] + k] <= specs[3])
-            if t[j,k] == 1:
-                model.add_constraint(model.sum(x[i] * b[i][j,k] for i in beam_range) \
-                                   + model.sum(x_l[i] * left_b[i][j,k] for i in beam_range) \
-                                   + model.sum(x_r[i] * right_b[i][j,k] for i in beam_range) \
-                                     + s_x[j * specs[2] + k] >= specs[4])
-    print('Intensity constraints added.')
+    with stage('build') as info:
+        # Create critical neighbor map and slice out the interior of the tumor
+        masks = region_masks(c, t, margin_width, interior_size)
+        c_neighbor, tr = masks['c_neighbor'], masks['tr']
+        t = t - tr
         
-    # Objective Function
-    obj = model.objective_expr
-    for j in vert_range:
-        for k in hori_range:
-            obj += sum(x[i] * b[i][j,k] * (c[j,k] + p_neighbor * c_neighbor[j,k]) for i in beam_range) \
-                + sum(x_l[i] * left_b[i][j,k] * (c[j,k] + p_neighbor * c_neighbor[j,k]) for i in beam_range) \
-                + sum(x_r[i] * right_b[i][j,k] * (c[j,k] + p_neighbor * c_neighbor[j,k]) for i in beam_range) \
-                + c_x[j * specs[2] + k] * c[j,k] \
-                + s_x[j * specs[2] + k] * (t[j,k] + tr[j,k] * p_regrow)
-    print('Object Function Constructed.')
-    
-    model.minimize(obj)
-    model.export_as_lp("test.lp")
-    
-    print('Model Exported.')
-    
-    model.print_information()
-    solution = model.solve()
-    if solution != None:
-        print('Model Solved.')
-    else:
-        print('ERROR: NO SOLUTION')
-    
-    return solution, t 
\ No newline at end of file
+        # One dose-influence matrix over all three beam sets, in the order x, x_l, x_r; the two magnetic
+        # fields deflect every beam left and right. A D passed in must already hold all three sets
+        if D is None:
+            left_b, right_b = magnetic_beams(b, intensity)
+            D = np.concatenate((b, left_b, right_b), axis=0)
+        D = as_influence(D, c)
+        tumor_rows = D.rows(t)
+        
+        plan = PlanLP('m1', D, D.critical_rows, tumor_rows, specs[3], specs[4], 
+                      D.beam_weights(c + p_neighbor * c_neighbor),
+                      critical_cost = c.ravel()[D.critical_rows], 
+                      tumor_cost = (t + tr * p_regrow).ravel()[tumor_rows], 
+                      critical_ub = 2, tumor_ub = 20)
+        info.update(plan.stats())
+        info['message'] = 'Model Constructed.'
+    if not solve:
+        return plan, t
+    
+    return solve_plan(plan, backend, presolve, lazy = lazy, start = start), t 
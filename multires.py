@@ -0,0 +1,70 @@
+import inspect
+import numpy as np
+
+import models as md
+from geometry import margin
+from plan import solve_plan
+from active_set import solve_active_set
+
+
+def coarsen(specs, c, t, b, factor = 2):
+    """Downsample the maps by an integer factor: a coarse pixel is in a region if any of its block is,
+    and its beam dose is the block mean"""
+    
+    rows, cols = -(-specs[1] // factor) * factor, -(-specs[2] // factor) * factor
+    
+    def blocks(a):
+        # Pad the last axes up to whole blocks, then expose each block as two extra axes
+        a = np.asarray(a, dtype = float)
+        pad = [(0, 0)] * (a.ndim - 2) + [(0, rows - a.shape[-2]), (0, cols - a.shape[-1])]
+        a = np.pad(a, pad)
+        return a.reshape(a.shape[:-2] + (rows // factor, factor, cols // factor, factor))
+    
+    c_coarse = blocks(c).max(axis = (-3, -1))
+    t_coarse = blocks(t).max(axis = (-3, -1))
+    b_coarse = blocks(b).mean(axis = (-3, -1))
+    specs_coarse = [specs[0], rows // factor, cols // factor, specs[3], specs[4]]
+    
+    return specs_coarse, c_coarse, t_coarse, b_coarse
+
+
+def _region_edge(mask, width):
+    """Return the pixels of a region that lie within width pixels of its boundary"""
+    
+    return margin(1 - (np.asarray(mask) == 1), width)
+
+
+def solve_multires(model_name, specs, c, t, b, factor = 2, backend = 'highs', edge_width = 1, log_output = True, **params):
+    """Solve a model on a coarse grid first, then solve the full grid warm-started from the coarse
+    intensities and with only the rows near region boundaries or violated by them, adding violated
+    rows until none remain"""
+    
+    build = getattr(md, model_name)
+    coarse_params = dict(params)
+    if 'interior_size' in inspect.signature(build).parameters:
+        coarse_params['interior_size'] = max(1, params.get('interior_size', 10) // factor)
+    
+    # Coarse solve; the beams are the same, so its intensities apply directly at full resolution
+    coarse_plan = build(*coarsen(specs, c, t, b, factor), solve = False, **coarse_params)
+    coarse_plan = coarse_plan[0] if isinstance(coarse_plan, tuple) else coarse_plan
+    coarse_plan.log_output = log_output
+    coarse = solve_plan(coarse_plan, backend)
+    
+    plan = build(specs, c, t, b, solve = False, **params)
+    plan, t_model = plan if isinstance(plan, tuple) else (plan, t)
+    plan.log_output = log_output
+    if coarse is None:
+        critical_active, tumor_active = np.arange(0, len(plan.critical_rows)), np.arange(0, len(plan.tumor_rows))
+    else:
+        # Start from the boundary rows and every row the coarse plan violates at full resolution
+        dose = plan.D.matrix @ coarse.x
+        critical_edge = _region_edge(c, edge_width).ravel()[plan.critical_rows] == 1
+        tumor_edge = _region_edge(t_model, edge_width).ravel()[plan.tumor_rows] == 1
+        critical_active = np.flatnonzero(critical_edge | (dose[plan.critical_rows] > plan.max_dose))
+        tumor_active = np.flatnonzero(tumor_edge | (dose[plan.tumor_rows] < plan.min_dose))
+    
+    result = solve_active_set(plan, critical_active, tumor_active, backend, start = coarse)
+    if result is not None:
+        result.coarse = coarse
+        
+    return (result, t_model) if model_name in ('build_model_4', 'build_model_5') else result
@@ -0,0 +1,89 @@
+import os
+import numpy as np
+
+from instrument import emit
+
+
+def shape_mask(shape, rows, cols, center, radius, rng = None):
+    """Return a 0/1 mask of an 'ellipse', 'rectangle', or 'blob' with the given center and (vertical, horizontal) radius"""
+    
+    jj, kk = np.mgrid[0:rows, 0:cols]
+    dj, dk = (jj - center[0]) / max(radius[0], 1), (kk - center[1]) / max(radius[1], 1)
+    if shape == 'ellipse':
+        mask = dj ** 2 + dk ** 2 <= 1
+    elif shape == 'rectangle':
+        mask = (np.abs(dj) <= 1) & (np.abs(dk) <= 1)
+    elif shape == 'blob':
+        # An ellipse whose boundary is pushed in and out by a few random harmonics
+        rng = np.random.default_rng(0) if rng is None else rng
+        angle = np.arctan2(dj, dk)
+        edge = 1 + sum(rng.uniform(-0.15, 0.15) * np.cos(n * angle + rng.uniform(0, 2 * np.pi)) for n in range(2, 5))
+        mask = np.sqrt(dj ** 2 + dk ** 2) <= edge
+    else:
+        raise ValueError('Unknown shape ' + repr(shape) + ', expected one of ellipse, rectangle, blob')
+    
+    return mask.astype(float)
+
+
+def phantom_beams(num_beams, rows, cols, target, width = 3.0, spread = 5.0, attenuation = 0.02, rng = None):
+    """Return (beams, rows, cols) dose maps of straight beams entering from evenly spread angles,
+    each aimed within about spread pixels of the target, with a Gaussian profile across the beam and exponential falloff along it"""
+    
+    rng = np.random.default_rng(0) if rng is None else rng
+    jj, kk = np.mgrid[0:rows, 0:cols]
+    beams = np.zeros((num_beams, rows, cols))
+    for i in range(0, num_beams):
+        angle = np.pi * i / num_beams
+        aim = np.asarray(target) + rng.normal(0, spread, 2)
+        u = np.array([np.sin(angle), np.cos(angle)])
+    
+        # Distance across the beam, and depth along it from the edge of the grid
+        across = (jj - aim[0]) * u[1] - (kk - aim[1]) * u[0]
+        along = (jj - aim[0]) * u[0] + (kk - aim[1]) * u[1]
+        depth = along - along.min()
+        beam = np.exp(-across ** 2 / (2 * width ** 2)) * np.exp(-attenuation * depth)
+    
+        # Two decimals, like the example data, keeps the maps sparse and the text files small
+        beams[i] = np.round(beam, 2)
+    
+    return beams
+
+
+def generate_phantom(folder_name, num_beams = 126, rows = 60, cols = 80, tumor_shape = 'ellipse',
+                     critical_shape = 'ellipse', tumor_radius = None, critical_radius = None,
+                     max_dose = 2, min_dose = 10, seed = 0):
+    """Write a synthetic dataset to task/task/<folder_name> in the same format as the example folders
+    
+    The tumor sits at the center of the grid and the critical region sits beside it, so the two
+    regions compete for the same beams. Radii default to a fraction of the grid."""
+    
+    rng = np.random.default_rng(seed)
+    tumor_radius = tumor_radius or (max(rows // 6, 1), max(cols // 6, 1))
+    critical_radius = critical_radius or (max(rows // 8, 1), max(cols // 8, 1))
+    tumor_center = (rows / 2, cols / 2)
+    critical_center = (rows / 2, cols / 2 + tumor_radius[1] + critical_radius[1] + 1)
+    
+    t = shape_mask(tumor_shape, rows, cols, tumor_center, tumor_radius, rng)
+    c = shape_mask(critical_shape, rows, cols, critical_center, critical_radius, rng) * (1 - t)
+    b = phantom_beams(num_beams, rows, cols, tumor_center, width = max(min(rows, cols) / 20, 1), 
+                      spread = max(tumor_radius), rng = rng)
+    
+    # Write the maps in the layout load_data expects: beams separated by blank lines
+    path = 'task/task/' + folder_name + '/'
+    os.makedirs(path, exist_ok = True)
+    with open(path + 'specs.txt', 'w') as f:
+        f.write('Number of beams: ' + str(num_beams) + '\n')
+        f.write('Vertical pixel resolution: ' + str(rows) + '\n')
+        f.write('Horizontal pixel resolution: ' + str(cols) + '\n')
+        f.write('Maximum Dose Allowed Over Critical Area: ' + str(int(max_dose)) + '\n')
+        f.write('Minimum Dose Required Over Tumor Area: ' + str(int(min_dose)) + '\n')
+    np.savetxt(path + 'critical_raw.txt', c, fmt = '%g')
+    np.savetxt(path + 'tumor_raw.txt', t, fmt = '%g')
+    with open(path + 'beam_raw.txt', 'w') as f:
+        for i in range(0, num_beams):
+            if i > 0:
+                f.write('\n')
+            np.savetxt(f, b[i], fmt = '%g')
+    emit('phantom_written', message = 'Phantom Written: ' + folder_name, folder = folder_name)
+    
+    return [num_beams, rows, cols, int(max_dose), int(min_dose)]
@@ -0,0 +1,261 @@
+import time
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linprog
+
+from instrument import emit, stage
+
+
+class PlanLP():
+    """Backend-neutral form shared by every model: dose limits on region pixels, softened by bounded slack"""
+    
+    def __init__(self, name, D, critical_rows, tumor_rows, max_dose, min_dose, beam_cost,
+                 critical_cost = None, tumor_cost = None, critical_ub = 0, tumor_ub = 0, log_output = True,
+                 threads = None, time_limit = None):
+        self.name = name
+        self.D = D
+        self.critical_rows = np.asarray(critical_rows)
+        self.tumor_rows = np.asarray(tumor_rows)
+        self.max_dose, self.min_dose = max_dose, min_dose
+        
+        # An upper bound of 0 means the region has no slack/surplus variables, None means unbounded
+        self.critical_ub, self.tumor_ub = critical_ub, tumor_ub
+        self.num_critical_slack = len(self.critical_rows) if critical_ub != 0 else 0
+        self.num_tumor_surplus = len(self.tumor_rows) if tumor_ub != 0 else 0
+        
+        self.beam_cost = np.asarray(beam_cost, dtype = float)
+        self.critical_cost = np.zeros(self.num_critical_slack) if critical_cost is None \
+                             else np.asarray(critical_cost, dtype = float)
+        self.tumor_cost = np.zeros(self.num_tumor_surplus) if tumor_cost is None \
+                          else np.asarray(tumor_cost, dtype = float)
+        self.log_output = log_output
+        
+        # Solver limits; None leaves the solver's own default
+        self.threads, self.time_limit = threads, time_limit
+        
+    def cost(self):
+        """Return the objective coefficients in the variable order x, critical slack, tumor surplus"""
+        
+        return np.concatenate((self.beam_cost, self.critical_cost, self.tumor_cost))
+    
+    def start_vector(self, x):
+        """Return every variable's value at intensities x, with the slack and surplus x implies clipped to
+        their bounds, in the variable order of cost(); used to start the solvers from x"""
+        
+        dose = self.D.matrix @ np.asarray(x, dtype = float)
+        critical = np.clip(dose[self.critical_rows] - self.max_dose, 0, self.critical_ub)
+        tumor = np.clip(self.min_dose - dose[self.tumor_rows], 0, self.tumor_ub)
+        
+        return np.concatenate((x, critical[:self.num_critical_slack], tumor[:self.num_tumor_surplus]))
+    
+    def stats(self):
+        """Return the variable, constraint, and nonzero counts of the lowered LP"""
+        
+        rows = len(self.critical_rows) + len(self.tumor_rows)
+        nonzeros = self.D.matrix[self.critical_rows].nnz + self.D.matrix[self.tumor_rows].nnz \
+                   + self.num_critical_slack + self.num_tumor_surplus
+        
+        return {'model': self.name, 'variables': len(self.cost()), 'constraints': rows, 'nonzeros': nonzeros}
+    
+    def to_arrays(self):
+        """Lower the plan to linprog-style c, A_ub, b_ub, and bounds"""
+        
+        n_x, n_c, n_s = self.D.num_beams, self.num_critical_slack, self.num_tumor_surplus
+        A_c = self.D.matrix[self.critical_rows]
+        A_t = -self.D.matrix[self.tumor_rows]
+        if n_c:
+            A_c = sparse.hstack([A_c, -sparse.identity(n_c), sparse.csr_matrix((n_c, n_s))])
+        else:
+            A_c = sparse.hstack([A_c, sparse.csr_matrix((A_c.shape[0], n_s))])
+        if n_s:
+            A_t = sparse.hstack([A_t, sparse.csr_matrix((n_s, n_c)), -sparse.identity(n_s)])
+        else:
+            A_t = sparse.hstack([A_t, sparse.csr_matrix((A_t.shape[0], n_c))])
+        A_ub = sparse.vstack([A_c, A_t], format = 'csr')
+        b_ub = np.concatenate((np.full(A_c.shape[0], float(self.max_dose)), 
+                               np.full(A_t.shape[0], -float(self.min_dose))))
+        
+        bounds = np.zeros((n_x + n_c + n_s, 2))
+        bounds[:, 1] = np.inf
+        bounds[n_x:n_x + n_c, 1] = np.inf if self.critical_ub is None else self.critical_ub
+        bounds[n_x + n_c:, 1] = np.inf if self.tumor_ub is None else self.tumor_ub
+        
+        return self.cost(), A_ub, b_ub, bounds
+    
+    def to_docplex(self):
+        """Lower the plan to a docplex model, returning it with its x, slack, and surplus variable lists"""
+        
+        from docplex.mp.advmodel import AdvModel
+        model = AdvModel(name = self.name, log_output = self.log_output)
+        if self.threads is not None:
+            model.parameters.threads = self.threads
+        if self.time_limit is not None:
+            model.parameters.timelimit = self.time_limit
+        cols = self.D.grid_shape[1]
+        
+        # Add beam intensity variables, non-negative through their lower bound
+        x = model.continuous_var_list(keys=self.D.num_beams, lb = 0)
+        
+        # Add slack and surplus variables to allow for flexibility with critical and tumor regions
+        c_x = model.continuous_var_list(keys=[('critical_slack', r // cols, r % cols) 
+                                              for r in self.critical_rows[:self.num_critical_slack]],
+                                        lb = 0, ub = self.critical_ub)
+        s_x = model.continuous_var_list(keys=[('tumor_surplus', r // cols, r % cols) 
+                                              for r in self.tumor_rows[:self.num_tumor_surplus]],
+                                        lb = 0, ub = self.tumor_ub)
+        
+        # Add constraints given beam intensity variables, regions, and slack/surplus variables
+        add_region_constraints(model, x, self.D, self.critical_rows, self.max_dose, 'le', c_x or None)
+        add_region_constraints(model, x, self.D, self.tumor_rows, self.min_dose, 'ge', s_x or None)
+        
+        # Objective Function
+        model.minimize(model.scal_prod_vars_all_different(x + c_x + s_x, self.cost()))
+        
+        return model, x, c_x, s_x
+
+
+
+class PlanResult():
+    """A solved plan: beam intensities, slack/surplus values, and solve statistics from either backend"""
+    
+    def __init__(self, x, critical_slack, tumor_surplus, objective_value, backend, solve_time, solution = None,
+                 iterations = None):
+        self.x = np.asarray(x, dtype = float)
+        self.critical_slack = np.asarray(critical_slack, dtype = float)
+        self.tumor_surplus = np.asarray(tumor_surplus, dtype = float)
+        self.objective_value = objective_value
+        self.backend = backend
+        self.solve_time = solve_time
+        self.solution = solution
+        self.iterations = iterations
+        
+    def __repr__(self):
+        return 'PlanResult(backend=' + self.backend + ', objective=' + str(self.objective_value) + ')'
+
+
+
+def add_region_constraints(model, x, D, rows, rhs, sense, slack = None):
+    """Add the dose constraints of a region in one matrix call, with an optional slack/surplus per row"""
+    
+    if len(rows) == 0:
+        return []
+    A = D.matrix[rows]
+    if slack is not None:
+        sign = -1 if sense == 'le' else 1
+        A = sparse.hstack([A, sign * sparse.identity(len(rows), format='csr')], format='csr')
+        x = list(x) + list(slack)
+    
+    return model.add_constraints(model.matrix_constraints(A, x, np.full(len(rows), float(rhs)), sense))
+
+
+def export_plan(plan, path):
+    """Write the plan as an LP or MPS file through docplex, chosen by the extension of path"""
+    
+    model = plan.to_docplex()[0]
+    if path.lower().endswith('.mps'):
+        model.export_as_mps(path)
+    else:
+        model.export_as_lp(path)
+    emit('export', path = path, message = 'Model Exported.')
+    
+    return path
+
+
+def solve_cplex(plan, start = None):
+    """Build the plan in docplex and solve it with CPLEX, from intensities start if given"""
+    
+    model, x, c_x, s_x = plan.to_docplex()
+    if start is not None:
+        # Primal simplex is the method that makes use of a primal-only start
+        model.parameters.lpmethod = 1
+        model.get_cplex().start.set_start(col_status = [], row_status = [], col_primal = list(plan.start_vector(start)),
+                                          row_primal = [], col_dual = [], row_dual = [])
+    t0 = time.perf_counter()
+    solution = model.solve()
+    solve_time = time.perf_counter() - t0
+    if solution == None:
+        return None
+    
+    return PlanResult(solution.get_values(x), solution.get_values(c_x), solution.get_values(s_x),
+                      solution.objective_value, 'cplex', solve_time, solution,
+                      model.get_cplex().solution.progress.get_num_iterations())
+
+
+def solve_highs(plan, start = None):
+    """Lower the plan to sparse arrays and solve it with HiGHS through scipy.optimize.linprog, or
+    through highspy from intensities start or with a thread cap, since linprog takes neither"""
+    
+    if start is not None or plan.threads is not None:
+        from planner import Planner
+        planner = Planner(plan, 'highs')
+        return planner.solve() if start is None else planner.set_start(start).solve()
+    c, A_ub, b_ub, bounds = plan.to_arrays()
+    t0 = time.perf_counter()
+    options = {'disp': plan.log_output}
+    if plan.time_limit is not None:
+        options['time_limit'] = plan.time_limit
+    res = linprog(c, A_ub = A_ub, b_ub = b_ub, bounds = bounds, method = 'highs', options = options)
+    solve_time = time.perf_counter() - t0
+    if res.status != 0:
+        emit('solver_status', backend = 'highs', status = res.status, message = 'HiGHS: ' + res.message)
+        return None
+    
+    n_x, n_c = plan.D.num_beams, plan.num_critical_slack
+    return PlanResult(res.x[:n_x], res.x[n_x:n_x + n_c], res.x[n_x + n_c:], 
+                      res.fun, 'highs', solve_time, res, res.nit)
+
+
+def _solve_empty(plan, backend):
+    """A plan with no variables is solved exactly when every constraint holds at zero"""
+    
+    c, A_ub, b_ub, bounds = plan.to_arrays()
+    if np.all(b_ub >= 0):
+        return PlanResult([], [], [], 0.0, backend, 0.0)
+    
+    return None
+
+
+BACKENDS = {'cplex': solve_cplex, 'highs': solve_highs}
+
+
+def solve_plan(plan, backend = 'cplex', presolve = False, export = None, lazy = False, start = None):
+    """Solve a plan with the named backend, returning a PlanResult or None if there is no solution;
+    with presolve, a reduced plan is solved and its solution expanded back to every pixel, with lazy,
+    critical rows are only added once they are violated, and with export the plan is first written 
+    to that .lp or .mps path. start, a PlanResult or beam intensities such as a fluence.solve_fluence
+    preview, warm-starts the solver; lazy solves do not use it"""
+    
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend ' + str(backend) + ', expected one of ' + str(sorted(BACKENDS)))
+    if presolve or lazy or start is not None:
+        from robust import RobustPlan
+        if isinstance(plan, RobustPlan):
+            raise ValueError('presolve, lazy, and start only see the nominal rows; solve a RobustPlan without them')
+    start = None if start is None else np.asarray(getattr(start, 'x', start), dtype = float)
+    def solve(p, x0):
+        if not len(p.cost()):
+            return _solve_empty(p, backend)
+        if lazy:
+            from active_set import solve_lazy
+            return solve_lazy(p, backend)
+        return BACKENDS[backend](p, x0)
+    
+    if export is not None:
+        export_plan(plan, export)
+    with stage('solve', backend = backend, presolve = presolve, lazy = lazy, warm = start is not None,
+               **plan.stats()) as info:
+        if presolve:
+            from presolve import Presolved
+            reduced = Presolved(plan)
+            solution = reduced.expand(solve(reduced.reduced, None if start is None else start[reduced.beams]))
+        else:
+            solution = solve(plan, start)
+        info['solved'] = solution != None
+        info['objective'] = solution.objective_value if solution != None else None
+        info['iterations'] = solution.iterations if solution != None else None
+        if lazy and hasattr(solution, 'rounds'):
+            info['rounds'], info['active_rows'] = solution.rounds, sum(solution.active_rows)
+            info['converged'] = solution.converged
+        info['message'] = 'Model Solved.' if solution != None else 'ERROR: NO SOLUTION'
+    
+    return solution
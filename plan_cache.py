@@ -0,0 +1,145 @@
+import os
+import io
+import json
+import hashlib
+import zipfile
+import numpy as np
+import pandas as pd
+
+import models as md
+import analytics as an
+from load_data import array_key
+from plan import PlanResult, solve_plan
+from instrument import emit
+
+# Solved plans are stored under a key derived from everything that decides the solution: the
+# critical, tumor, and beam arrays, the specs, the model variant, its parameters, and the backend.
+# Each entry is one compressed .npz file; reading it touches its mtime, so eviction removes the
+# least recently used entries first once the store is over its size budget.
+
+
+class PlanCache():
+    """A content-addressed on-disk store of solved plans with size-based LRU eviction"""
+    
+    def __init__(self, path = '.plan_cache', max_bytes = 256 * 2 ** 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok = True)
+    
+    def key(self, model_name, specs, c, t, b, params = None, backend = 'highs'):
+        """Return the key of a model variant and its parameters solved on a dataset"""
+    
+        spec = json.dumps({'model': model_name, 'specs': [int(s) for s in specs],
+                           'params': params or {}, 'backend': backend}, sort_keys = True, default = str)
+    
+        return hashlib.sha1((array_key(c, t, b) + spec).encode()).hexdigest()
+    
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+    
+    def get(self, key):
+        """Return the stored PlanResult, with its dose map, metrics, and tumor mask, or None on a miss;
+        an entry that cannot be read is deleted and counts as a miss"""
+    
+        path = self._file(key)
+        try:
+            with np.load(path) as f:
+                arrays = {name: f[name] for name in f.files}
+            result = PlanResult(arrays['x'], arrays['critical_slack'], arrays['tumor_surplus'],
+                                float(arrays['objective_value']), str(arrays['backend']),
+                                float(arrays['solve_time']))
+            result.dose = arrays['dose']
+            result.tumor = arrays['tumor']
+            result.metrics = pd.read_json(io.StringIO(str(arrays['metrics'])), orient = 'table')
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            emit('plan_cache', key = key, hit = False, corrupt = True)
+            return None
+    
+        # Another process may have evicted the entry since it was read
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        emit('plan_cache', key = key, hit = True)
+    
+        return result
+    
+    def put(self, key, result, dose, metrics, tumor):
+        """Store a solved plan with its dose map, metrics table, and the tumor mask it was scored on"""
+    
+        # Write to a private temp name and rename, so readers never see half a file
+        tmp = self._file(key) + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, x = result.x, critical_slack = result.critical_slack,
+                                tumor_surplus = result.tumor_surplus,
+                                objective_value = result.objective_value, backend = result.backend,
+                                solve_time = result.solve_time, dose = np.asarray(dose),
+                                tumor = np.asarray(tumor),
+                                metrics = metrics.to_json(orient = 'table', index = False))
+        os.replace(tmp, self._file(key))
+        self.evict()
+    
+        return None
+    
+    def size(self):
+        """Return the total bytes held by the store"""
+    
+        return sum(e.stat().st_size for e in os.scandir(self.path) if e.name.endswith('.npz'))
+    
+    def evict(self):
+        """Remove the least recently used entries until the store fits in max_bytes"""
+    
+        entries = sorted((e.stat().st_mtime_ns, e.stat().st_size, e.path)
+                         for e in os.scandir(self.path) if e.name.endswith('.npz'))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+    
+        return None
+    
+    def clear(self):
+        """Remove every entry"""
+    
+        for e in os.scandir(self.path):
+            if e.name.endswith('.npz'):
+                os.remove(e.path)
+    
+        return None
+
+
+
+def cached_solve(model_name, specs, c, t, b, backend = 'highs', cache = None, **params):
+    """Solve a model variant through the plan cache, solving and storing it only on a miss
+    
+    Returns the PlanResult with .dose (the delivered dose map), .metrics (the dose_metrics table),
+    and .tumor (the tumor mask the model scores against, which models 4 and 5 shrink)."""
+    
+    cache = PlanCache() if cache is None else cache
+    key = cache.key(model_name, specs, c, t, b, params, backend)
+    result = cache.get(key)
+    if result is not None:
+        return result
+    
+    plan = getattr(md, model_name)(specs, c, t, b, solve = False, **params)
+    plan, t_model = plan if isinstance(plan, tuple) else (plan, t)
+    result = solve_plan(plan, backend)
+    if result is None:
+        return None
+    
+    # The plan's influence matrix already includes any shifted beam sets
+    result.dose = plan.D.dose(result.x)
+    result.tumor = np.asarray(t_model)
+    result.metrics = an.dose_metrics(result.dose, c, t_model, specs[3], specs[4])
+    cache.put(key, result, result.dose, result.metrics, result.tumor)
+    emit('plan_cache', key = key, hit = False)
+    
+    return result
@@ -0,0 +1,309 @@
+import time
+import numpy as np
+
+from plan import PlanResult
+
+
+class Planner():
+    """A plan whose constraints are built once; objective weights and slack bounds change in place
+    and each re-solve warm-starts from the previous basis"""
+    
+    def __init__(self, plan, backend = 'highs'):
+        self.plan = plan
+        self.backend = backend
+        n_x, n_c = plan.D.num_beams, plan.num_critical_slack
+        self._x = np.arange(0, n_x)
+        self._c = np.arange(n_x, n_x + n_c)
+        self._s = np.arange(n_x + n_c, n_x + n_c + plan.num_tumor_surplus)
+        self._ncols = n_x + n_c + plan.num_tumor_surplus
+        self._freed = {'critical': {}, 'tumor': {}}
+        
+        # The model row (HiGHS) or constraint (CPLEX) of each critical and tumor row, in plan order
+        n_cr, n_tr = len(plan.critical_rows), len(plan.tumor_rows)
+        self._crow, self._trow = np.arange(0, n_cr), np.arange(n_cr, n_cr + n_tr)
+        
+        if backend == 'cplex':
+            # docplex keeps the CPLEX engine alive and forwards later changes to it incrementally
+            self.model, self.x, self.c_x, self.s_x = plan.to_docplex()
+            self.vars = self.x + self.c_x + self.s_x
+            self._cons = list(self.model.iter_linear_constraints())
+        elif backend == 'highs':
+            import highspy
+            self._optimal = highspy.HighsModelStatus.kOptimal
+            c, A_ub, b_ub, bounds = plan.to_arrays()
+            self.model = highspy.Highs()
+            self.model.setOptionValue('output_flag', bool(plan.log_output))
+            if plan.threads is not None:
+                self.model.setOptionValue('threads', int(plan.threads))
+            if plan.time_limit is not None:
+                self.model.setOptionValue('time_limit', float(plan.time_limit))
+            self.model.addVars(len(c), bounds[:, 0], bounds[:, 1])
+            self.model.changeColsCost(len(c), np.arange(0, len(c), dtype = np.int32), c)
+            self.model.addRows(A_ub.shape[0], np.full(A_ub.shape[0], -np.inf), b_ub, A_ub.nnz,
+                               A_ub.indptr[:-1].astype(np.int32), A_ub.indices.astype(np.int32), A_ub.data)
+        else:
+            raise ValueError('Unknown backend ' + str(backend) + ", expected 'cplex' or 'highs'")
+    
+    def _set_costs(self, idx, cost):
+        """Push new objective coefficients for the columns idx, and only those"""
+        
+        if len(idx) == 0:
+            return
+        if self.backend == 'cplex':
+            # One in-place edit of the objective expression, forwarded to the engine once
+            self.model.objective_expr.set_coefficients([(self.vars[i], float(v)) for i, v in zip(idx, cost)])
+        else:
+            self.model.changeColsCost(len(idx), idx.astype(np.int32), np.asarray(cost, dtype = float))
+    
+    def _set_upper(self, idx, ub):
+        """Push new upper bounds for the columns idx"""
+        
+        if self.backend == 'cplex':
+            for i, u in zip(idx, ub):
+                self.vars[i].ub = u
+        else:
+            self.model.changeColsBounds(len(idx), idx.astype(np.int32), np.zeros(len(idx)), ub)
+    
+    def set_objective(self, beam_cost = None, critical_cost = None, tumor_cost = None):
+        """Replace any of the objective coefficient vectors, leaving the constraints untouched; only the
+        coefficients that change are pushed, all in one update"""
+        
+        cols, values = [], []
+        for name, idx, cost in (('beam_cost', self._x, beam_cost), 
+                                ('critical_cost', self._c, critical_cost), 
+                                ('tumor_cost', self._s, tumor_cost)):
+            if cost is None:
+                continue
+            cost = np.broadcast_to(np.asarray(cost, dtype = float), idx.shape).copy()
+            changed = np.flatnonzero(getattr(self.plan, name) != cost)
+            setattr(self.plan, name, cost)
+            cols.append(idx[changed])
+            values.append(cost[changed])
+        if cols:
+            self._set_costs(np.concatenate(cols), np.concatenate(values))
+            
+        return self
+    
+    def set_pixel_weights(self, weights):
+        """Set the beam costs from a per-pixel dose weight map, such as c + p_neighbor * c_neighbor"""
+        
+        return self.set_objective(beam_cost = self.plan.D.beam_weights(weights))
+    
+    def set_bounds(self, critical_ub = None, tumor_ub = None):
+        """Change the upper bounds on the critical slack and tumor surplus variables"""
+        
+        for idx, ub in ((self._c, critical_ub), (self._s, tumor_ub)):
+            if ub is None:
+                continue
+            if len(idx) == 0:
+                raise ValueError('This plan has no slack/surplus variables for that region')
+            self._set_upper(idx, np.broadcast_to(np.asarray(ub, dtype = float), idx.shape))
+            
+        return self
+    
+    def set_beams(self, active):
+        """Allow only the listed beams to deliver dose; the others are held at zero intensity"""
+        
+        ub = np.zeros(len(self._x))
+        ub[np.asarray(active, dtype = int)] = np.inf
+        if self.backend == 'cplex':
+            ub = [None if np.isinf(u) else u for u in ub]
+        self._set_upper(self._x, ub)
+        
+        return self
+    
+    def add_rows(self, critical_rows = (), tumor_rows = (), critical_cost = None, tumor_cost = None):
+        """Add dose constraints, and their slack/surplus variables, for more critical and tumor pixels;
+        the next solve starts from the current basis"""
+        
+        plan, D = self.plan, self.plan.D
+        for region, rows, cost in (('critical', critical_rows, critical_cost), ('tumor', tumor_rows, tumor_cost)):
+            rows = np.asarray(rows, dtype = int)
+            if len(rows) == 0:
+                continue
+            ub = plan.critical_ub if region == 'critical' else plan.tumor_ub
+            rhs = plan.max_dose if region == 'critical' else plan.min_dose
+            cost = np.zeros(len(rows)) if cost is None else np.asarray(cost, dtype = float)
+            
+            # A pixel coming back reuses the slack column remove_rows freed for it; other new columns go
+            # after every existing column, and new rows after every existing row
+            cols, fresh = np.zeros(0, dtype = int), np.zeros(0, dtype = int)
+            if ub != 0:
+                freed = self._freed[region]
+                cols = np.array([freed.pop(r, -1) for r in rows], dtype = int)
+                fresh = np.flatnonzero(cols < 0)
+                cols[fresh] = np.arange(self._ncols, self._ncols + len(fresh))
+                self._ncols += len(fresh)
+                reused = np.setdiff1d(cols, cols[fresh])
+                if len(reused):
+                    u = np.full(len(reused), np.inf if ub is None else float(ub))
+                    self._set_upper(reused, [ub] * len(reused) if self.backend == 'cplex' else u)
+            
+            if self.backend == 'cplex':
+                from plan import add_region_constraints
+                cols_n = D.grid_shape[1]
+                name = 'critical_slack' if region == 'critical' else 'tumor_surplus'
+                new = self.model.continuous_var_list(keys=[(name, r // cols_n, r % cols_n) for r in rows[fresh]],
+                                                     lb = 0, ub = ub) if ub != 0 else []
+                self.vars = self.vars + new
+                cons = add_region_constraints(self.model, self.x, D, rows, rhs, 'le' if region == 'critical' else 'ge', 
+                                              [self.vars[i] for i in cols] or None)
+                model_rows = np.arange(len(self._cons), len(self._cons) + len(rows))
+                self._cons = self._cons + list(cons)
+            else:
+                ub_cols = np.full(len(fresh), np.inf if ub is None else float(ub))
+                if len(cols):
+                    self.model.addVars(len(fresh), np.zeros(len(fresh)), ub_cols)
+                    self.model.changeColsCost(len(cols), cols.astype(np.int32), cost)
+                
+                # Rows are kept in the <= form of to_arrays: tumor rows are negated
+                sign = 1.0 if region == 'critical' else -1.0
+                A = D.matrix[rows].tocsr()
+                indptr, indices, data = A.indptr, A.indices, sign * A.data
+                if len(cols):
+                    counts = np.diff(indptr)
+                    indices = np.insert(indices, indptr[1:], cols)
+                    data = np.insert(data, indptr[1:], -np.ones(len(cols)))
+                    indptr = np.concatenate(([0], np.cumsum(counts + 1)))
+                model_rows = np.arange(self.model.getNumRow(), self.model.getNumRow() + len(rows))
+                self.model.addRows(len(rows), np.full(len(rows), -np.inf), np.full(len(rows), sign * rhs),
+                                   len(indices), indptr[:-1].astype(np.int32), 
+                                   indices.astype(np.int32), data.astype(float))
+            
+            # Grow the plan so its rows and costs stay aligned with the slack columns
+            if region == 'critical':
+                plan.critical_rows = np.concatenate((plan.critical_rows, rows))
+                self._crow = np.concatenate((self._crow, model_rows))
+                if len(cols):
+                    plan.critical_cost = np.concatenate((plan.critical_cost, cost))
+                    plan.num_critical_slack += len(cols)
+                    self._c = np.concatenate((self._c, cols))
+            else:
+                plan.tumor_rows = np.concatenate((plan.tumor_rows, rows))
+                self._trow = np.concatenate((self._trow, model_rows))
+                if len(cols):
+                    plan.tumor_cost = np.concatenate((plan.tumor_cost, cost))
+                    plan.num_tumor_surplus += len(cols)
+                    self._s = np.concatenate((self._s, cols))
+            if self.backend == 'cplex' and len(cols):
+                self._set_costs(cols, cost)
+        
+        return self
+    
+    def remove_rows(self, critical = (), tumor = ()):
+        """Drop the dose constraints at these positions in plan.critical_rows and plan.tumor_rows;
+        their slack/surplus columns stay in the model fixed at zero, so no column is renumbered,
+        and are reused if the same pixel is added back"""
+        
+        plan = self.plan
+        critical = np.unique(np.asarray(critical, dtype = int))
+        tumor = np.unique(np.asarray(tumor, dtype = int))
+        if len(critical) == 0 and len(tumor) == 0:
+            return self
+        model_rows = np.concatenate((self._crow[critical], self._trow[tumor]))
+        cols = np.concatenate((self._c[critical] if len(self._c) else np.zeros(0, dtype = int),
+                               self._s[tumor] if len(self._s) else np.zeros(0, dtype = int)))
+        
+        if self.backend == 'cplex':
+            self.model.remove_constraints([self._cons[r] for r in model_rows])
+        else:
+            self.model.deleteRows(len(model_rows), np.sort(model_rows).astype(np.int32))
+            self.model.changeColsCost(len(cols), cols.astype(np.int32), np.zeros(len(cols)))
+        self._set_upper(cols, np.zeros(len(cols)))
+        if len(self._c):
+            self._freed['critical'].update(zip(plan.critical_rows[critical], self._c[critical]))
+        if len(self._s):
+            self._freed['tumor'].update(zip(plan.tumor_rows[tumor], self._s[tumor]))
+        
+        # Forget the removed rows, and renumber the HiGHS rows that came after them
+        keep_c = np.setdiff1d(np.arange(0, len(plan.critical_rows)), critical)
+        keep_t = np.setdiff1d(np.arange(0, len(plan.tumor_rows)), tumor)
+        self._crow, self._trow = self._crow[keep_c], self._trow[keep_t]
+        if self.backend == 'highs':
+            gone = np.sort(model_rows)
+            self._crow = self._crow - np.searchsorted(gone, self._crow)
+            self._trow = self._trow - np.searchsorted(gone, self._trow)
+        plan.critical_rows, plan.tumor_rows = plan.critical_rows[keep_c], plan.tumor_rows[keep_t]
+        if plan.num_critical_slack:
+            plan.critical_cost, self._c = plan.critical_cost[keep_c], self._c[keep_c]
+            plan.num_critical_slack = len(self._c)
+        if plan.num_tumor_surplus:
+            plan.tumor_cost, self._s = plan.tumor_cost[keep_t], self._s[keep_t]
+            plan.num_tumor_surplus = len(self._s)
+        
+        return self
+    
+    def update(self, new_plan):
+        """Turn the live plan into new_plan, a plan of the same model over the same beams with different
+        regions: only rows whose pixel joined or left a region are added or removed, and only costs
+        that changed are pushed; the next solve starts from the current basis"""
+        
+        plan = self.plan
+        changes = {}
+        for region in ('critical', 'tumor'):
+            old_rows, new_rows = getattr(plan, region + '_rows'), getattr(new_plan, region + '_rows')
+            changes[region + '_removed'] = np.flatnonzero(~np.isin(old_rows, new_rows))
+            changes[region + '_added'] = new_rows[~np.isin(new_rows, old_rows)]
+        self.remove_rows(changes['critical_removed'], changes['tumor_removed'])
+        
+        def costs_of(rows, region):
+            """Return new_plan's slack/surplus costs for these rows, or None if the region has none"""
+            if not getattr(new_plan, 'num_' + ('critical_slack' if region == 'critical' else 'tumor_surplus')):
+                return None
+            all_rows = getattr(new_plan, region + '_rows')
+            order = np.argsort(all_rows)
+            return getattr(new_plan, region + '_cost')[order[np.searchsorted(all_rows[order], rows)]]
+        
+        self.add_rows(changes['critical_added'], changes['tumor_added'],
+                      costs_of(changes['critical_added'], 'critical'), costs_of(changes['tumor_added'], 'tumor'))
+        
+        # Push only the costs that differ from the live ones
+        self.set_objective(new_plan.beam_cost, costs_of(plan.critical_rows, 'critical') if len(self._c) else None,
+                           costs_of(plan.tumor_rows, 'tumor') if len(self._s) else None)
+        self.last_update = {k: len(v) for k, v in changes.items()}
+        
+        return self
+    
+    def set_start(self, x):
+        """Start the next solve from intensities x, such as a fluence.solve_fluence preview, with the
+        slack and surplus they imply"""
+        
+        values = np.zeros(self._ncols)
+        full = self.plan.start_vector(getattr(x, 'x', x))
+        values[self._x], values[self._c], values[self._s] = np.split(full, [len(self._x), len(self._x) + len(self._c)])
+        if self.backend == 'cplex':
+            # Primal simplex is the method that makes use of a primal-only start
+            self.model.parameters.lpmethod = 1
+            self.model.get_cplex().start.set_start(col_status = [], row_status = [], col_primal = list(values),
+                                                   row_primal = [], col_dual = [], row_dual = [])
+        else:
+            import highspy
+            start = highspy.HighsSolution()
+            start.col_value = list(values)
+            start.value_valid = True
+            self.model.setSolution(start)
+        
+        return self
+    
+    def solve(self):
+        """Re-solve from the previous basis, returning a PlanResult or None if there is no solution"""
+        
+        start = time.perf_counter()
+        if self.backend == 'cplex':
+            solution = self.model.solve()
+            solve_time = time.perf_counter() - start
+            if solution == None:
+                return None
+            values = np.asarray(solution.get_values(self.vars))
+            return PlanResult(values[self._x], values[self._c], values[self._s], 
+                              solution.objective_value, 'cplex', solve_time, solution,
+                              self.model.get_cplex().solution.progress.get_num_iterations())
+        
+        self.model.run()
+        solve_time = time.perf_counter() - start
+        if self.model.getModelStatus() != self._optimal:
+            return None
+        values = np.asarray(self.model.getSolution().col_value)
+        return PlanResult(values[self._x], values[self._c], values[self._s], 
+                          self.model.getObjectiveValue(), 'highs', solve_time, 
+                          iterations = self.model.getInfo().simplex_iteration_count)
@@ -0,0 +1,105 @@
+import numpy as np
+
+from influence import DoseInfluence
+from plan import PlanLP, PlanResult
+
+
+def _group_identical_rows(A):
+    """Group the rows of a CSR matrix with identical entries, returning the first row of each group
+    and, for every row, the index of its group"""
+    
+    groups, first, inverse = {}, [], np.empty(A.shape[0], dtype = int)
+    for r in range(0, A.shape[0]):
+        lo, hi = A.indptr[r], A.indptr[r + 1]
+        key = (A.indices[lo:hi].tobytes(), A.data[lo:hi].tobytes())
+        if key not in groups:
+            groups[key] = len(first)
+            first.append(r)
+        inverse[r] = groups[key]
+        
+    return np.asarray(first, dtype = int), inverse
+
+
+class Presolved():
+    """A plan reduced before solving, with the maps needed to expand its solution back to every pixel"""
+    
+    def __init__(self, plan):
+        self.plan = plan
+        D = plan.D
+        D.matrix.sort_indices()
+        
+        # Beams that never reach the tumor can only add critical dose, so with a non-negative cost they stay at 0
+        tumor_dose = np.asarray(abs(D.matrix[plan.tumor_rows]).sum(axis = 0)).ravel()
+        self.beams = np.flatnonzero((tumor_dose > 0) | (plan.beam_cost < 0))
+        matrix = D.matrix[:, self.beams].tocsr()
+        matrix.sort_indices()
+        
+        # Critical pixels that no remaining beam reaches can never bind
+        reached = np.diff(matrix.indptr)[plan.critical_rows] > 0
+        self.critical_keep = np.flatnonzero(reached)
+        
+        # Pixels of a region with identical influence rows share one constraint, and one slack variable
+        # whose cost is the sum of theirs; this holds as long as those costs are non-negative
+        self.critical_first, self.critical_group = self._merge(matrix, plan.critical_rows[self.critical_keep], 
+                                                               plan.critical_cost[self.critical_keep] 
+                                                               if plan.num_critical_slack else None)
+        self.tumor_first, self.tumor_group = self._merge(matrix, plan.tumor_rows, 
+                                                         plan.tumor_cost if plan.num_tumor_surplus else None)
+        
+        critical_rows = plan.critical_rows[self.critical_keep][self.critical_first]
+        tumor_rows = plan.tumor_rows[self.tumor_first]
+        critical_cost = tumor_cost = None
+        if plan.num_critical_slack:
+            critical_cost = np.bincount(self.critical_group, plan.critical_cost[self.critical_keep], 
+                                        minlength = len(self.critical_first))
+        if plan.num_tumor_surplus:
+            tumor_cost = np.bincount(self.tumor_group, plan.tumor_cost, minlength = len(self.tumor_first))
+        
+        self.reduced = PlanLP(plan.name, DoseInfluence.from_matrix(matrix, D.grid_shape), 
+                              critical_rows, tumor_rows, plan.max_dose, plan.min_dose, 
+                              plan.beam_cost[self.beams], critical_cost, tumor_cost, 
+                              plan.critical_ub, plan.tumor_ub, plan.log_output, 
+                              plan.threads, plan.time_limit)
+        
+    def _merge(self, matrix, rows, cost):
+        """Group identical rows, unless negative slack costs make merging unsafe"""
+        
+        if cost is not None and np.any(cost < 0):
+            return np.arange(0, len(rows)), np.arange(0, len(rows))
+        return _group_identical_rows(matrix[rows])
+    
+    def stats(self):
+        """Return the size of the plan before and after presolve"""
+        
+        return {'beams': (self.plan.D.num_beams, len(self.beams)),
+                'critical_rows': (len(self.plan.critical_rows), len(self.reduced.critical_rows)),
+                'tumor_rows': (len(self.plan.tumor_rows), len(self.reduced.tumor_rows))}
+        
+    def expand(self, result):
+        """Map a solution of the reduced plan back to every beam and region pixel of the original"""
+        
+        if result is None:
+            return None
+        x = np.zeros(self.plan.D.num_beams)
+        x[self.beams] = result.x
+        critical_slack = np.zeros(self.plan.num_critical_slack)
+        if self.plan.num_critical_slack:
+            critical_slack[self.critical_keep] = result.critical_slack[self.critical_group]
+        tumor_surplus = result.tumor_surplus[self.tumor_group] if self.plan.num_tumor_surplus \
+                        else np.zeros(0)
+        
+        expanded = PlanResult(x, critical_slack, tumor_surplus, result.objective_value, 
+                              result.backend, result.solve_time, result.solution, result.iterations)
+        
+        # Keep what a lazy solve reports; active_rows counts rows of the reduced plan
+        for name in ('rounds', 'active_rows', 'converged'):
+            if hasattr(result, name):
+                setattr(expanded, name, getattr(result, name))
+        
+        return expanded
+
+
+def presolve(plan):
+    """Reduce a plan by dropping idle beams and never-binding pixels and merging identical pixels"""
+    
+    return Presolved(plan)
@@ -0,0 +1,112 @@
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib import image as mpimg
+
+from analytics import region_cmaps
+
+# Headless rendering for batches of plans. A PlanRenderer owns one Agg figure that is never
+# registered with pyplot, so it needs no display and is never leaked; each render only swaps the
+# data of its three images (dose map, critical overlay, tumor overlay) and redraws.
+
+
+class PlanRenderer():
+    """A reusable Agg figure that draws dose maps the way plot_beams does, returning RGBA arrays"""
+    
+    def __init__(self, size = 6, dpi = 100, cmap_choice = 'magma'):
+        self.fig = Figure(figsize = (size, size), dpi = dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_axes([0, 0, 1, 0.94])
+        self.ax.axis('off')
+        self.title = self.ax.set_title('')
+        self.cmap_choice = cmap_choice
+        self.images = None
+        self.shape = None
+    
+    def _draw(self, base, cmap, c = None, t = None, vmax = None, title = ''):
+        base = np.asarray(base, dtype = float)
+        if self.images is None:
+            critical_cmap, tumor_cmap = region_cmaps()
+            self.images = (self.ax.imshow(base, cmap = cmap),
+                           self.ax.imshow(np.zeros(base.shape), cmap = critical_cmap, vmin = 0, vmax = 1),
+                           self.ax.imshow(np.zeros(base.shape), cmap = tumor_cmap, vmin = 0, vmax = 1))
+        m_img, c_img, t_img = self.images
+    
+        # A new grid shape only needs the image extents and axis limits reset
+        if base.shape != self.shape:
+            extent = (-0.5, base.shape[1] - 0.5, base.shape[0] - 0.5, -0.5)
+            for img in self.images:
+                img.set_extent(extent)
+            self.ax.set_xlim(extent[0], extent[1])
+            self.ax.set_ylim(extent[2], extent[3])
+            self.shape = base.shape
+    
+        m_img.set_data(base)
+        m_img.set_cmap(cmap)
+        m_img.set_clim(0, base.max() if vmax is None else vmax)
+        for img, mask in ((c_img, c), (t_img, t)):
+            img.set_visible(mask is not None)
+            if mask is not None:
+                img.set_data(np.asarray(mask, dtype = float))
+        self.title.set_text(title)
+        self.canvas.draw()
+    
+        return np.asarray(self.canvas.buffer_rgba()).copy()
+    
+    def render(self, m, c, t, vmax = None, title = 'Map of Radiation'):
+        """Return the dose map with the critical and tumor overlays as an RGBA array"""
+    
+        return self._draw(m, self.cmap_choice, c, t, vmax, title)
+    
+    def render_delivery(self, m, mask, region = 'tumor', vmax = None):
+        """Return the dose delivered inside one region, as in report_effectiveness, as an RGBA array"""
+    
+        cmap = 'Greens' if region == 'tumor' else 'Reds'
+        title = 'Map of ' + region.capitalize() + ' Delivery'
+    
+        return self._draw(np.asarray(m) * np.asarray(mask), cmap, vmax = vmax, title = title)
+    
+    def save(self, path, m, c, t, vmax = None, title = 'Map of Radiation'):
+        """Render a plan straight to a PNG file"""
+    
+        mpimg.imsave(path, self.render(m, c, t, vmax, title))
+    
+        return path
+
+
+
+def render_plans(maps, c, t, renderer = None, titles = None, shared_scale = True):
+    """Render a stack of dose maps with one figure, returning a (plans, height, width, 4) array"""
+    
+    maps = np.asarray(maps, dtype = float).reshape((-1,) + np.shape(c))
+    renderer = PlanRenderer() if renderer is None else renderer
+    vmax = maps.max() if shared_scale else None
+    titles = ['Plan ' + str(i) for i in range(0, len(maps))] if titles is None else titles
+    
+    return np.stack([renderer.render(m, c, t, vmax, title) for m, title in zip(maps, titles)])
+
+
+def contact_sheet(frames, path = None, cols = 4):
+    """Tile rendered frames into one image, writing it as a PNG if a path is given"""
+    
+    frames = np.asarray(frames)
+    n, h, w, d = frames.shape
+    rows = -(-n // cols)
+    sheet = np.full((rows * h, cols * w, d), 255, dtype = frames.dtype)
+    for i in range(0, n):
+        r, k = divmod(i, cols)
+        sheet[r * h:(r + 1) * h, k * w:(k + 1) * w] = frames[i]
+    if path is not None:
+        mpimg.imsave(path, sheet)
+    
+    return sheet
+
+
+def animate(frames, path, fps = 4):
+    """Write rendered frames as an animated GIF"""
+    
+    from PIL import Image
+    images = [Image.fromarray(np.asarray(f)) for f in frames]
+    images[0].save(path, save_all = True, append_images = images[1:], duration = int(1000 / fps), loop = 0)
+    
+    return path
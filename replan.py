@@ -0,0 +1,40 @@
+import time
+
+import models as md
+from influence import DoseInfluence
+from planner import Planner
+from instrument import emit
+
+# Re-planning after the contours change. The beams, and so the dose-influence matrix, stay the same;
+# only the critical and tumor masks move. The model is rebuilt on the existing matrix (its costs come
+# from whole-grid mask operations, which are cheap), and the live Planner is edited in place: rows
+# whose pixel left a region are deleted, rows whose pixel joined one are added, and only costs that
+# changed are pushed. The solve then starts from the previous basis.
+
+
+def start_replan(model_name, specs, c, t, b, backend = 'highs', **params):
+    """Build a model as a live Planner ready for replan; returns the planner and its first result"""
+    
+    plan = getattr(md, model_name)(specs, c, t, b, solve = False, backend = backend, **params)
+    plan = plan[0] if isinstance(plan, tuple) else plan
+    planner = Planner(plan, backend)
+    
+    return planner, planner.solve()
+
+
+def replan(planner, model_name, specs, c, t, **params):
+    """Re-solve the planner's model for new masks c and t, editing only the rows and costs that changed
+    
+    Returns the result, with the remaining tumor map as well for the models that return one."""
+    
+    start = time.perf_counter()
+    D = DoseInfluence.from_matrix(planner.plan.D.matrix, planner.plan.D.grid_shape)
+    new_plan = getattr(md, model_name)(specs, c, t, None, D = D, solve = False, backend = planner.backend, **params)
+    new_plan, t_model = new_plan if isinstance(new_plan, tuple) else (new_plan, None)
+    planner.update(new_plan)
+    edit_time = time.perf_counter() - start
+    result = planner.solve()
+    emit('replanned', message = 'Replanned: ' + str(planner.last_update), edit_s = edit_time,
+         solve_s = None if result is None else result.solve_time, **planner.last_update)
+    
+    return result if t_model is None else (result, t_model)
@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import models as md
+from analytics import coverage
+from plan import PlanLP, solve_plan
+from instrument import emit
+
+# A setup shift (dy, dx) moves the patient against the beams, so pixel (j, k) receives the dose the
+# beams deliver at (j + dy, k + dx), and nothing if that falls off the grid. A shifted influence
+# matrix is therefore a row gather of the nominal one, and every scenario's constraint block is
+# assembled from one gather over all scenarios at once.
+
+
+def setup_shifts(max_shift = 1, step = 1):
+    """Return every (dy, dx) shift with both components in [-max_shift, max_shift], nominal first"""
+    
+    r = np.arange(-max_shift, max_shift + 1, step)
+    shifts = np.array([(dy, dx) for dy in r for dx in r if (dy, dx) != (0, 0)], dtype = int).reshape(-1, 2)
+    
+    return np.vstack(([[0, 0]], shifts))
+
+
+def shifted_rows(rows, grid_shape, shifts):
+    """Return the (scenarios, rows) nominal pixel row that each region row reads under each shift, -1 off the grid"""
+    
+    rows_n, cols_n = grid_shape
+    j, k = np.divmod(np.asarray(rows), cols_n)
+    shifts = np.asarray(shifts).reshape(-1, 2)
+    sj, sk = j[None, :] + shifts[:, :1], k[None, :] + shifts[:, 1:]
+    inside = (sj >= 0) & (sj < rows_n) & (sk >= 0) & (sk < cols_n)
+    
+    return np.where(inside, sj * cols_n + sk, -1)
+
+
+def shift_map(m, dy, dx):
+    """Return the map seen under a (dy, dx) setup shift: out[j, k] = m[j + dy, k + dx], zero off the grid"""
+    
+    m = np.asarray(m)
+    out = np.zeros_like(m)
+    rows, cols = m.shape
+    out[max(-dy, 0):rows - max(dy, 0), max(-dx, 0):cols - max(dx, 0)] = \
+        m[max(dy, 0):rows - max(-dy, 0), max(dx, 0):cols - max(-dx, 0)]
+    
+    return out
+
+
+
+class RobustPlan(PlanLP):
+    """A plan whose dose limits must hold under every setup shift
+    
+    Tumor rows get a surplus per scenario, costed at the plan's tumor cost over the number of
+    scenarios. Each critical row keeps one slack shared by all scenarios, so its cost is paid on the
+    worst-case excess. The variable order stays x, critical slack, tumor surplus (scenario-major).
+    solve_plan solves it directly; presolve, lazy, and start work on the nominal rows only, so
+    solve_plan rejects them for a RobustPlan."""
+    
+    def __init__(self, plan, shifts):
+        self.__dict__.update(plan.__dict__)
+        self.shifts = np.asarray(shifts, dtype = int).reshape(-1, 2)
+        n = len(self.shifts)
+        self.critical_src = shifted_rows(self.critical_rows, self.D.grid_shape, self.shifts)
+        self.tumor_src = shifted_rows(self.tumor_rows, self.D.grid_shape, self.shifts)
+        self.num_tumor_surplus = plan.num_tumor_surplus * n
+        self.tumor_cost = np.tile(plan.tumor_cost, n) / n
+    
+    def _block(self, src):
+        """Return the influence rows of every scenario stacked, with off-grid rows empty"""
+    
+        src = src.ravel()
+        A = self.D.matrix[np.maximum(src, 0)]
+    
+        return sparse.diags((src >= 0).astype(float)) @ A
+    
+    def stats(self):
+        """Return the variable, constraint, and nonzero counts of the lowered LP"""
+    
+        row_nnz = np.append(np.diff(self.D.matrix.indptr), 0)
+        nonzeros = row_nnz[self.critical_src].sum() + row_nnz[self.tumor_src].sum() \
+                   + self.critical_src.size * (self.num_critical_slack > 0) + self.num_tumor_surplus
+    
+        return {'model': self.name, 'variables': len(self.cost()), 'scenarios': len(self.shifts),
+                'constraints': self.critical_src.size + self.tumor_src.size, 'nonzeros': int(nonzeros)}
+    
+    def start_vector(self, x):
+        """Not supported: a start would need a surplus per scenario"""
+    
+        raise ValueError('A RobustPlan cannot be warm-started; solve it without start')
+    
+    def to_arrays(self):
+        """Lower the plan to linprog-style c, A_ub, b_ub, and bounds, every scenario in one block per region"""
+    
+        n_x, n_c, n_s = self.D.num_beams, self.num_critical_slack, self.num_tumor_surplus
+        n = len(self.shifts)
+        A_c, A_t = self._block(self.critical_src), -self._block(self.tumor_src)
+    
+        # Every scenario row of a critical pixel subtracts the same slack column
+        if n_c:
+            r = np.arange(0, A_c.shape[0])
+            S_c = sparse.csr_matrix((-np.ones(len(r)), (r, np.tile(np.arange(0, n_c), n))), shape = (len(r), n_c))
+        else:
+            S_c = sparse.csr_matrix((A_c.shape[0], 0))
+        A_c = sparse.hstack([A_c, S_c, sparse.csr_matrix((A_c.shape[0], n_s))])
+        if n_s:
+            A_t = sparse.hstack([A_t, sparse.csr_matrix((n_s, n_c)), -sparse.identity(n_s)])
+        else:
+            A_t = sparse.hstack([A_t, sparse.csr_matrix((A_t.shape[0], n_c))])
+        A_ub = sparse.vstack([A_c, A_t], format = 'csr')
+        b_ub = np.concatenate((np.full(A_c.shape[0], float(self.max_dose)),
+                               np.full(A_t.shape[0], -float(self.min_dose))))
+    
+        bounds = np.zeros((n_x + n_c + n_s, 2))
+        bounds[:, 1] = np.inf
+        bounds[n_x:n_x + n_c, 1] = np.inf if self.critical_ub is None else self.critical_ub
+        bounds[n_x + n_c:, 1] = np.inf if self.tumor_ub is None else self.tumor_ub
+    
+        return self.cost(), A_ub, b_ub, bounds
+    
+    def to_docplex(self):
+        """Lower the plan to a docplex model from its arrays, returning it with its x, slack, and surplus variable lists"""
+    
+        from docplex.mp.advmodel import AdvModel
+        model = AdvModel(name = self.name, log_output = self.log_output)
+        if self.threads is not None:
+            model.parameters.threads = self.threads
+        if self.time_limit is not None:
+            model.parameters.timelimit = self.time_limit
+        c, A_ub, b_ub, bounds = self.to_arrays()
+        ub = [None if np.isinf(u) else u for u in bounds[:, 1]]
+        v = model.continuous_var_list(len(c), lb = 0, ub = ub)
+        model.add_constraints(model.matrix_constraints(A_ub, v, b_ub, 'le'))
+        model.minimize(model.scal_prod_vars_all_different(v, c))
+        n_x, n_c = self.D.num_beams, self.num_critical_slack
+    
+        return model, v[:n_x], v[n_x:n_x + n_c], v[n_x + n_c:]
+
+
+
+def scenario_doses(plan, x):
+    """Return the (scenarios, rows, cols) dose maps the intensities x deliver under each setup shift"""
+    
+    m = plan.D.dose(x)
+    
+    return np.stack([shift_map(m, dy, dx) for dy, dx in plan.shifts])
+
+
+def scenario_coverage(plan, x, c, t):
+    """Return the coverage and worst critical dose of the intensities x under each setup shift"""
+    
+    c = np.asarray(c)
+    rows = []
+    for (dy, dx), m in zip(plan.shifts, scenario_doses(plan, x)):
+        critical_pct, tumor_pct = coverage(m, c, t, plan.max_dose, plan.min_dose)
+        rows.append({'dy': dy, 'dx': dx, 'critical_pct': critical_pct, 'tumor_pct': tumor_pct,
+                     'critical_max': m[c == 1].max() if np.any(c == 1) else 0.0})
+    
+    return pd.DataFrame(rows)
+
+
+def build_robust_model(specs, c, t, b, variant = 'build_model_4', shifts = None, max_shift = 1,
+                       solve = True, backend = 'highs', **params):
+    """Build model 3 or 4 as a plan that must hold under every setup shift (by default every shift
+    up to max_shift pixels in each direction) and solve it; returns what the variant returns"""
+    
+    plan = getattr(md, variant)(specs, c, t, b, solve = False, **params)
+    plan, t_model = plan if isinstance(plan, tuple) else (plan, None)
+    plan = RobustPlan(plan, setup_shifts(max_shift) if shifts is None else shifts)
+    emit('model_constructed', message = 'Robust Model Constructed.', **plan.stats())
+    result = plan if not solve else solve_plan(plan, backend)
+    
+    return result if t_model is None else (result, t_model)
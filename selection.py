@@ -0,0 +1,286 @@
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from plan import PlanResult
+from planner import Planner
+from instrument import emit
+
+# Beam-subset selection: plan with at most K active beams. select_beams_milp is exact, with a binary
+# on/off variable per beam tied to its intensity by big-M. greedy_path is the fast heuristic: it
+# scores beams on the plan's own objective with the optimal slack and surplus substituted in,
+# piecewise linear in each intensity, so adding or re-weighting one beam is a 1-D line search over
+# that beam's dose column instead of an LP solve.
+
+
+def big_m(plan):
+    """Return an upper bound on each beam's intensity that the optimum never needs to exceed
+    
+    With non-negative costs, raising a beam past the dose that alone covers every tumor pixel it
+    reaches only adds critical dose, so min_dose over its smallest tumor coefficient is enough.
+    Beams that reach no tumor pixel get 0."""
+    
+    A_t = sparse.csc_matrix(plan.D.matrix[plan.tumor_rows])
+    M = np.zeros(plan.D.num_beams)
+    for i in range(0, plan.D.num_beams):
+        v = A_t.data[A_t.indptr[i]:A_t.indptr[i + 1]]
+        v = v[v > 0]
+        if len(v):
+            M[i] = plan.min_dose / v.min()
+    
+    return M
+
+
+def select_beams_milp(plan, K, backend = 'highs', time_limit = None):
+    """Solve the plan exactly with at most K active beams, returning a PlanResult with .beams"""
+    
+    if np.any(plan.cost() < 0):
+        raise ValueError('Big-M bounds need non-negative costs; ' + plan.name + ' has negative ones')
+    n_x = plan.D.num_beams
+    M = big_m(plan)
+    c, A_ub, b_ub, bounds = plan.to_arrays()
+    n = len(c)
+    start = time.perf_counter()
+    
+    if backend == 'cplex':
+        model, x, c_x, s_x = plan.to_docplex()
+        y = model.binary_var_list(n_x, name = 'on')
+        model.add_constraints(x[i] <= M[i] * y[i] for i in range(0, n_x))
+        model.add_constraint(model.sum(y) <= K)
+        if time_limit is not None:
+            model.parameters.timelimit = time_limit
+        solution = model.solve()
+        if solution == None:
+            return None
+        result = PlanResult(solution.get_values(x), solution.get_values(c_x), solution.get_values(s_x),
+                            solution.objective_value, 'cplex', time.perf_counter() - start, solution)
+    elif backend == 'highs':
+        from scipy.optimize import milp, LinearConstraint, Bounds
+        # Columns are the plan's variables followed by one binary per beam
+        link = sparse.hstack([sparse.identity(n_x), sparse.csr_matrix((n_x, n - n_x)), -sparse.diags(M)])
+        budget = sparse.hstack([sparse.csr_matrix((1, n)), sparse.csr_matrix(np.ones((1, n_x)))])
+        A = sparse.vstack([sparse.hstack([A_ub, sparse.csr_matrix((A_ub.shape[0], n_x))]), link, budget],
+                          format = 'csr')
+        upper = np.concatenate((b_ub, np.zeros(n_x), [K]))
+        options = {'disp': plan.log_output}
+        if time_limit is not None:
+            options['time_limit'] = time_limit
+        res = milp(np.concatenate((c, np.zeros(n_x))), integrality = np.concatenate((np.zeros(n), np.ones(n_x))),
+                   bounds = Bounds(np.concatenate((bounds[:, 0], np.zeros(n_x))),
+                                   np.concatenate((bounds[:, 1], np.ones(n_x)))),
+                   constraints = LinearConstraint(A, -np.inf, upper), options = options)
+        if res.x is None:
+            return None
+        n_c = plan.num_critical_slack
+        result = PlanResult(res.x[:n_x], res.x[n_x:n_x + n_c], res.x[n_x + n_c:n], res.fun, 'highs',
+                            time.perf_counter() - start, res)
+    else:
+        raise ValueError('Unknown backend ' + str(backend) + ", expected 'cplex' or 'highs'")
+    result.beams = np.flatnonzero(result.x > 1e-9)
+    
+    return result
+
+
+
+class _Surrogate():
+    """The plan objective with optimal slack and surplus substituted in, for one beam at a time"""
+    
+    def __init__(self, plan):
+        # With a negative cost a beam's best intensity can be unbounded, so there is no line search
+        if np.any(plan.cost() < 0):
+            raise ValueError('The greedy surrogate needs non-negative costs; ' + plan.name + ' has negative ones')
+        self.plan = plan
+        self.A_c = sparse.csc_matrix(plan.D.matrix[plan.critical_rows])
+        self.A_t = sparse.csc_matrix(plan.D.matrix[plan.tumor_rows])
+        self.beam_cost = plan.beam_cost
+        
+        # Each region's cost is piecewise linear in the dose: the slack cost past the limit, then a
+        # large weight past the slack's upper bound, where the LP would be infeasible
+        hard = 1e3 * max(np.abs(plan.cost()).max(), 1)
+        n_c, n_t = len(plan.critical_rows), len(plan.tumor_rows)
+        self.critical_terms, self.tumor_terms = [], []
+        for terms, n, limit, sign, ub, cost, has_slack in (
+                (self.critical_terms, n_c, plan.max_dose, 1, plan.critical_ub, plan.critical_cost, plan.num_critical_slack),
+                (self.tumor_terms, n_t, plan.min_dose, -1, plan.tumor_ub, plan.tumor_cost, plan.num_tumor_surplus)):
+            if not has_slack:
+                terms.append((float(limit), np.full(n, hard)))
+                continue
+            terms.append((float(limit), np.asarray(cost, dtype = float)))
+            if ub is not None:
+                terms.append((float(limit + sign * ub), np.full(n, hard)))
+    
+    def value(self, x, dc, dt):
+        """Return the objective at intensities x with critical and tumor doses dc and dt"""
+        
+        return self.beam_cost @ x \
+               + sum(w @ np.maximum(dc - L, 0) for L, w in self.critical_terms) \
+               + sum(w @ np.maximum(L - dt, 0) for L, w in self.tumor_terms)
+    
+    def column(self, i):
+        """Return beam i's critical and tumor rows and dose coefficients"""
+        
+        A_c, A_t = self.A_c, self.A_t
+        return (A_c.indices[A_c.indptr[i]:A_c.indptr[i + 1]], A_c.data[A_c.indptr[i]:A_c.indptr[i + 1]],
+                A_t.indices[A_t.indptr[i]:A_t.indptr[i + 1]], A_t.data[A_t.indptr[i]:A_t.indptr[i + 1]])
+    
+    def step(self, i, dc, dt):
+        """Return the intensity to add to beam i that most lowers the objective, and the change"""
+        
+        rc, vc, rt, vt = self.column(i)
+        sc, st = dc[rc], dt[rt]
+        
+        # The slope in the added intensity only changes where a pixel crosses one of its limits:
+        # critical pixels start paying as they pass a limit, tumor pixels stop paying
+        slope, alpha, change = self.beam_cost[i], [], []
+        for L, w in self.critical_terms:
+            over = sc >= L
+            slope += (w[rc] * vc)[over].sum()
+            alpha.append((L - sc[~over]) / vc[~over])
+            change.append((w[rc] * vc)[~over])
+        for L, w in self.tumor_terms:
+            short = st < L
+            slope -= (w[rt] * vt)[short].sum()
+            alpha.append((L - st[short]) / vt[short])
+            change.append((w[rt] * vt)[short])
+        if slope >= 0 or sum(len(a) for a in alpha) == 0:
+            return 0.0, 0.0
+        alpha, change = np.concatenate(alpha), np.concatenate(change)
+        order = np.argsort(alpha)
+        alpha, slopes = alpha[order], slope + np.cumsum(change[order])
+        
+        # Stop at the first breakpoint where the slope turns non-negative
+        k = int(np.searchsorted(slopes >= 0, True))
+        k = min(k, len(alpha) - 1)
+        widths = np.diff(np.concatenate(([0.0], alpha[:k + 1])))
+        gain = (np.concatenate(([slope], slopes[:k])) * widths).sum()
+        
+        return alpha[k], gain
+    
+    def add(self, i, a, x, dc, dt):
+        """Add intensity a to beam i, updating x and the doses in place"""
+        
+        rc, vc, rt, vt = self.column(i)
+        x[i] += a
+        dc[rc] += a * vc
+        dt[rt] += a * vt
+    
+    def refine(self, beams, x, dc, dt, passes = 2):
+        """Re-optimize each listed beam's intensity with the others fixed"""
+        
+        for _ in range(0, passes):
+            for i in beams:
+                self.add(i, -x[i], x, dc, dt)
+                a, _ = self.step(i, dc, dt)
+                self.add(i, a, x, dc, dt)
+
+
+
+def greedy_path(plan, K, lazy = True, refine_passes = 2):
+    """Add beams one at a time, each the one that most lowers the objective at its best intensity,
+    re-weighting the chosen beams after every addition; returns the beams in the order added
+    
+    With lazy, gains from earlier rounds are kept as upper bounds and only the leading candidates
+    are re-scored, since adding beams rarely makes another beam more useful."""
+    
+    S = _Surrogate(plan)
+    x, dc, dt = np.zeros(plan.D.num_beams), np.zeros(len(plan.critical_rows)), np.zeros(len(plan.tumor_rows))
+    order, stale = [], {}
+    for _ in range(0, min(K, plan.D.num_beams)):
+        candidates = [i for i in range(0, plan.D.num_beams) if i not in order]
+        best, best_gain, best_a = None, 0.0, 0.0
+        if lazy and stale:
+            for i in sorted(candidates, key = lambda i: stale.get(i, -np.inf)):
+                if best is not None and stale.get(i, -np.inf) >= best_gain:
+                    break
+                a, gain = S.step(i, dc, dt)
+                stale[i] = gain
+                if gain < best_gain:
+                    best, best_gain, best_a = i, gain, a
+        else:
+            for i in candidates:
+                a, gain = S.step(i, dc, dt)
+                stale[i] = gain
+                if gain < best_gain:
+                    best, best_gain, best_a = i, gain, a
+        if best is None:
+            break
+        S.add(best, best_a, x, dc, dt)
+        order.append(best)
+        S.refine(order, x, dc, dt, refine_passes)
+    
+    return order
+
+
+def swap_refine(plan, beams, max_passes = 2):
+    """Try swapping each chosen beam for the best unchosen one, keeping swaps that lower the objective"""
+    
+    S = _Surrogate(plan)
+    beams = list(beams)
+    x, dc, dt = np.zeros(plan.D.num_beams), np.zeros(len(plan.critical_rows)), np.zeros(len(plan.tumor_rows))
+    for i in beams:
+        a, _ = S.step(i, dc, dt)
+        S.add(i, a, x, dc, dt)
+    S.refine(beams, x, dc, dt)
+    value = S.value(x, dc, dt)
+    
+    for _ in range(0, max_passes):
+        improved = False
+        for pos in range(0, len(beams)):
+            j = beams[pos]
+            x2, dc2, dt2 = x.copy(), dc.copy(), dt.copy()
+            S.add(j, -x2[j], x2, dc2, dt2)
+            gains = [(S.step(i, dc2, dt2)[1], i) for i in range(0, plan.D.num_beams) if i not in beams]
+            if not gains:
+                break
+            _, i = min(gains)
+            a, _ = S.step(i, dc2, dt2)
+            S.add(i, a, x2, dc2, dt2)
+            trial = beams[:pos] + [i] + beams[pos + 1:]
+            S.refine(trial, x2, dc2, dt2)
+            if S.value(x2, dc2, dt2) < value - 1e-9:
+                beams, x, dc, dt, value, improved = trial, x2, dc2, dt2, S.value(x2, dc2, dt2), True
+        if not improved:
+            break
+    
+    return beams
+
+
+def selection_curve(plan, ks = range(1, 21), method = 'greedy', backend = 'highs', swaps = True, time_limit = None):
+    """Return objective and coverage against the number of beams K
+    
+    With method 'greedy' the beam sets come from greedy_path (and swap_refine) and each is solved
+    exactly with the other beams held at zero, warm-started from the previous K. With 'milp' each
+    K is solved exactly by select_beams_milp."""
+    
+    ks = sorted(ks)
+    rows = []
+    if method == 'greedy':
+        start = time.perf_counter()
+        path = greedy_path(plan, ks[-1])
+        planner = Planner(plan, backend)
+        path_time = time.perf_counter() - start
+    for K in ks:
+        start = time.perf_counter()
+        if method == 'greedy':
+            beams = swap_refine(plan, path[:K]) if swaps else path[:K]
+            result = planner.set_beams(beams).solve()
+        elif method == 'milp':
+            result = select_beams_milp(plan, K, backend, time_limit)
+        else:
+            raise ValueError("Unknown method " + str(method) + ", expected 'greedy' or 'milp'")
+        row = {'K': K, 'time_s': time.perf_counter() - start}
+        if result is not None:
+            dose = plan.D.matrix @ result.x
+            row.update(beams = np.flatnonzero(result.x > 1e-9).tolist(), objective = result.objective_value,
+                       critical_pct = 100 * np.mean(dose[plan.critical_rows] <= plan.max_dose + 1e-7)
+                                      if len(plan.critical_rows) else 100.0,
+                       tumor_pct = 100 * np.mean(dose[plan.tumor_rows] >= plan.min_dose - 1e-7)
+                                   if len(plan.tumor_rows) else 100.0)
+        rows.append(row)
+        emit('beam_selection', method = method, **{k: v for k, v in row.items() if k != 'beams'})
+    curve = pd.DataFrame(rows)
+    if method == 'greedy':
+        curve.attrs['path_s'] = path_time
+    
+    return curve
@@ -0,0 +1,77 @@
+import time
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import load_data as ld
+import models as md
+import analytics as an
+from plan import solve_plan
+from instrument import set_sink
+
+# Dataset loaded once per worker process by _init_worker
+_DATA = {}
+
+
+def _init_worker(folder_name):
+    """Load the dataset once in each worker; the binary cache lets workers share its pages"""
+    
+    # Workers report nothing; the results table is the record of a sweep
+    set_sink(None)
+    specs = ld.get_specs(folder_name)
+    c, t, b = ld.load_data(folder_name, specs)
+    _DATA.update(folder = folder_name, specs = specs, c = c, t = t, b = b)
+
+
+def _solve_point(model_name, params, backend):
+    """Build and solve one parameter point, returning a row of the results table"""
+    
+    specs, c, t, b = _DATA['specs'], _DATA['c'], _DATA['t'], _DATA['b']
+    start = time.perf_counter()
+    plan = getattr(md, model_name)(specs, c, t, b, solve = False, **params)
+    plan, t_model = plan if isinstance(plan, tuple) else (plan, t)
+    plan.log_output = False
+    build_time = time.perf_counter() - start
+    sol = solve_plan(plan, backend)
+    
+    row = dict(params)
+    row.update(folder = _DATA['folder'], model = model_name, build_s = build_time)
+    if sol is None:
+        row.update(objective = np.nan, critical_pct = np.nan, tumor_pct = np.nan, solve_s = np.nan)
+        return row
+    
+    # The plan's influence matrix already includes any shifted beam sets
+    m = plan.D.dose(sol.x)
+    critical_pct, tumor_pct = an.coverage(m, c, t_model, specs[3], specs[4])
+    row.update(objective = sol.objective_value, critical_pct = critical_pct, 
+               tumor_pct = tumor_pct, solve_s = sol.solve_time)
+    
+    return row
+
+
+def parameter_grid(grid):
+    """Expand a dict of parameter lists into a list of parameter dicts, one per combination"""
+    
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def sweep(folder_name, model_name = 'build_model_4', grid = None, backend = 'highs', processes = None):
+    """Solve a model over every point of a parameter grid on a process pool and tabulate the results
+    
+    p_regrow only weights the tumor interior, which models 4 and 5 leave out of their tumor rows, so
+    it does not change their plans; the default grid sweeps the interior size instead."""
+    
+    if grid is None:
+        grid = {'p_neighbor': [0.25, 0.5, 1.0]}
+        if model_name in ('build_model_4', 'build_model_5'):
+            grid['interior_size'] = [5, 10, 15]
+    points = parameter_grid(grid)
+    
+    with ProcessPoolExecutor(max_workers = processes, initializer = _init_worker, 
+                             initargs = (folder_name,)) as pool:
+        rows = list(pool.map(_solve_point, [model_name] * len(points), points, [backend] * len(points)))
+    
+    return pd.DataFrame(rows)
@@ -1,64 +1,86 @@
-from docplex.mp.model import Model
+import sys
+import numpy as np
 
 # input file name is set as mat_raw.txt. remember to change it if you use a different file
-class modeling_data():
-    def __init__(self):
-        self.data_file_name = "mat_raw.txt"
+# usage: python mat.py [input file] [output file] [--check]
+# --check also solves the original LP over the whole stack and compares it with the streamed maximum
 
-        self.num_matrices = None
-        self.num_rows = None
-        self.num_columns = None
 
-        self.matrices = [[]]
+def read_matrices(file_name):
+    """Yield the blank-line-separated matrices of a file one at a time, so only one is ever in memory"""
 
-    def get_data_from_file(self):
-        file = open(self.data_file_name, 'r')
-        lines = file.readlines()
-        for line in lines:
-            l = line[:-1].split()
+    rows = []
+    with open(file_name, 'r') as file:
+        for line in file:
+            l = line.split()
             if l:
-                self.matrices[-1].append([])
-                for i in l:
-                    self.matrices[-1][-1].append(int(i))
-            else:
-                self.matrices.append([])
+                rows.append(l)
+            elif rows:
+                yield np.array(rows, dtype = float)
+                rows = []
+    if rows:
+        yield np.array(rows, dtype = float)
 
-        self.num_matrices = len(self.matrices)
-        self.num_rows = len(self.matrices[0])
-        self.num_columns = len(self.matrices[0][0])
 
-def build_model(data):
+def max_matrix(file_name):
+    """Return the element-wise maximum over the stack of matrices and the number of matrices read"""
+
+    result, count = None, 0
+    for m in read_matrices(file_name):
+        if result is None:
+            result = m
+        elif m.shape != result.shape:
+            raise ValueError('Matrix ' + str(count + 1) + ' has shape ' + str(m.shape) + ', expected ' + str(result.shape))
+        else:
+            np.maximum(result, m, out = result)
+        count += 1
+    if result is None:
+        raise ValueError(file_name + ' holds no matrices')
+
+    return result, count
+
+
+def print_result(filename, result):
+    """Write the maximum in the same layout as before: tab after each value, one row per line"""
+
+    with open(filename, 'w') as file:
+        for row in result:
+            file.write(''.join(str(v) + '\t' for v in row) + '\n')
+
+
+def build_model(matrices):
+    """The original formulation: minimize the sum of x_i_j with x_i_j >= every matrix's (i, j) entry"""
+
+    from docplex.mp.model import Model
     model = Model(log_output=True)
+    num_rows, num_columns = matrices[0].shape
 
     # Variables: x_i_j is the maximum value in the matrices
-    x = model.continuous_var_matrix(keys1=data.num_rows, keys2=data.num_columns, name="x")
+    x = model.continuous_var_matrix(keys1=num_rows, keys2=num_columns, name="x", lb=-model.infinity)
+    for m in matrices:
+        model.add_constraints(x[i,j] >= m[i,j] for i in range(num_rows) for j in range(num_columns))
+    model.minimize(model.sum(x))
 
-    for i in range(data.num_rows):
-        for j in range(data.num_columns):
-            for k in range(data.num_matrices):
-                model.add_constraint(x[i,j] >= data.matrices[k][i][j])
+    return model, x
 
-    e = model.linear_expr()
-    for i in range(data.num_rows):
-        for j in range(data.num_columns):
-            e += x[i,j]
 
-    model.minimize(e)
+def check_with_lp(file_name, result):
+    """Solve the LP over the whole stack and return the largest difference from the streamed maximum"""
 
-    return model
+    model, x = build_model(list(read_matrices(file_name)))
+    model.solve()
+    lp = np.array([[x[i,j].solution_value for j in range(result.shape[1])] for i in range(result.shape[0])])
 
-def print_result(filename, vars, data):
-    file = open(filename, 'w')
-    for i in range(data.num_rows):
-        for j in range(data.num_columns):
-            file.write(str(vars[i * data.num_rows + j].solution_value) + '\t')
-        file.write('\n')
+    return np.abs(lp - result).max()
 
 
-data = modeling_data()
-data.get_data_from_file()
-model = build_model(data)
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if a != '--check']
+    data_file_name = args[0] if len(args) > 0 else "mat_raw.txt"
+    result_file_name = args[1] if len(args) > 1 else "results.out"
 
-s = model.solve()
-x_vars = model.find_matching_vars(pattern="x_")
-print_result("results.out", x_vars, data)
+    result, count = max_matrix(data_file_name)
+    print_result(result_file_name, result)
+    print('Maximum of ' + str(count) + ' matrices written to ' + result_file_name)
+    if '--check' in sys.argv:
+        print('LP cross-check, largest difference: ' + str(check_with_lp(data_file_name, result)))
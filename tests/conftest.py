@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live flat at the repo root and read their data from task/task/ relative to it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
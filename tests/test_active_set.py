@@ -0,0 +1,56 @@
+import numpy as np
+
+import load_data as ld
+import models as md
+from active_set import solve_lazy
+from instrument import ListSink, set_sink
+
+
+def _plan():
+    specs = ld.get_specs('actualexample')
+    c, t, b = ld.load_data('actualexample', specs)
+    plan, t_model = md.build_model_4(specs, c, t, b, solve = False)
+    plan.log_output = False
+    return plan
+
+
+def test_lazy_converges_to_full_optimum():
+    sink = ListSink()
+    old = set_sink(sink)
+    try:
+        result = solve_lazy(_plan(), 'highs')
+    finally:
+        set_sink(old)
+    
+    assert result.converged
+    assert np.isclose(result.objective_value, 1066.340951, atol = 1e-4)
+    assert not any(e['event'] == 'active_set_unconverged' for e in sink.events)
+
+
+def test_lazy_flags_unconverged_when_rounds_run_out():
+    sink = ListSink()
+    old = set_sink(sink)
+    try:
+        result = solve_lazy(_plan(), 'highs', seed = 1, max_rounds = 1)
+    finally:
+        set_sink(old)
+    
+    assert result.rounds == 1
+    assert not result.converged
+    assert any(e['event'] == 'active_set_unconverged' for e in sink.events)
+
+
+def test_presolved_lazy_solve_keeps_its_convergence_report():
+    from plan import solve_plan
+    
+    sink = ListSink()
+    old = set_sink(sink)
+    try:
+        result = solve_plan(_plan(), 'highs', presolve = True, lazy = True)
+    finally:
+        set_sink(old)
+    
+    assert result.converged and result.rounds >= 1 and result.iterations > 0
+    assert np.isclose(result.objective_value, 1066.340951, atol = 1e-4)
+    solve = [e for e in sink.events if e['event'] == 'solve'][-1]
+    assert solve['converged'] and solve['iterations'] == result.iterations
@@ -0,0 +1,24 @@
+import os
+
+import batch
+
+
+def crash_on_bad_folder(folder_name, *args):
+    """Plan a case, killing the worker outright for the folder named 'crash'"""
+    
+    if folder_name == 'crash':
+        os._exit(1)
+    return batch._run_case(folder_name, *args)
+
+
+def test_empty_batch():
+    assert len(batch.run_batch([])) == 0
+
+
+def test_crashed_worker_does_not_fail_other_cases():
+    folders = ['crash', 'smallexample', 'actualexample', 'smallexample', 'actualexample', 'smallexample']
+    summary = batch.run_batch(folders, processes = 2, run_case = crash_on_bad_folder)
+    
+    assert list(summary['folder']) == folders
+    assert summary.loc[0, 'status'] == 'crashed'
+    assert (summary.loc[1:, 'status'] == 'optimal').all()
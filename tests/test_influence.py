@@ -0,0 +1,17 @@
+import numpy as np
+
+from influence import DoseInfluence, as_influence
+
+
+def test_prebuilt_influence_takes_rows_from_new_masks():
+    b = np.arange(1, 3 * 2 * 2 + 1, dtype = float).reshape(3, 2, 2)
+    c, t = np.array([[1, 0], [0, 0]]), np.array([[0, 0], [0, 1]])
+    D = DoseInfluence(b, c, t)
+    
+    c2, t2 = np.array([[0, 1], [0, 0]]), np.array([[0, 0], [1, 1]])
+    view = as_influence(D, c2, t2)
+    
+    assert list(view.critical_rows) == [1]
+    assert list(view.tumor_rows) == [2, 3]
+    assert np.shares_memory(view.matrix.data, D.matrix.data)
+    assert list(D.critical_rows) == [0] and list(D.tumor_rows) == [3]
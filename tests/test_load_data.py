@@ -0,0 +1,27 @@
+import json
+import os
+import shutil
+
+import load_data as ld
+from instrument import set_sink
+
+
+def test_manifest_missing_a_source_entry_is_rebuilt(tmp_path, monkeypatch):
+    folder = tmp_path / 'task' / 'task' / 'case'
+    shutil.copytree(os.path.join('task', 'task', 'smallexample'), str(folder),
+                    ignore = shutil.ignore_patterns(ld.CACHE_DIR))
+    monkeypatch.chdir(tmp_path)
+    old = set_sink(None)
+    try:
+        specs = ld.get_specs('case')
+        ld.load_data('case', specs)
+        path = folder / ld.CACHE_DIR / 'manifest.json'
+        manifest = json.loads(path.read_text())
+        del manifest['sources']['beam_raw.txt']
+        path.write_text(json.dumps(manifest))
+        
+        assert ld.get_specs('case') == specs
+        c, t, b = ld.load_data('case', specs)
+    finally:
+        set_sink(old)
+    assert b.shape[0] == specs[0]
@@ -0,0 +1,19 @@
+import load_data as ld
+import models as md
+from instrument import ListSink, set_sink
+
+
+def test_build_is_timed_as_a_stage():
+    specs = ld.get_specs('actualexample')
+    c, t, b = ld.load_data('actualexample', specs)
+    sink = ListSink()
+    old = set_sink(sink)
+    try:
+        plan, t_model = md.build_model_4(specs, c, t, b, solve = False)
+    finally:
+        set_sink(old)
+    
+    build = [e for e in sink.events if e['event'] == 'build']
+    assert len(build) == 1
+    assert build[0]['variables'] == len(plan.cost())
+    assert all(build[0][k] >= 0 for k in ('wall_s', 'cpu_s', 'peak_mb'))
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+
+from plan import PlanResult
+from plan_cache import PlanCache
+from analytics import dose_metrics
+from instrument import set_sink
+
+
+def _store(cache, key):
+    result = PlanResult(np.ones(3), np.zeros(1), np.zeros(1), 1.5, 'highs', 0.1)
+    dose = np.ones((2, 2))
+    mask = np.array([[1, 0], [0, 1]])
+    cache.put(key, result, dose, dose_metrics(dose, mask, mask), mask)
+
+
+def test_round_trip(tmp_path):
+    cache = PlanCache(str(tmp_path))
+    _store(cache, 'k')
+    old = set_sink(None)
+    try:
+        result = cache.get('k')
+    finally:
+        set_sink(old)
+    
+    assert result.objective_value == 1.5
+    assert np.array_equal(result.x, np.ones(3))
+
+
+def test_corrupt_entry_is_a_miss_and_removed(tmp_path):
+    cache = PlanCache(str(tmp_path))
+    _store(cache, 'k')
+    path = os.path.join(str(tmp_path), 'k.npz')
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+    
+    old = set_sink(None)
+    try:
+        assert cache.get('k') is None
+        assert cache.get('missing') is None
+    finally:
+        set_sink(old)
+    assert not os.path.exists(path)
+
+
+def test_cached_tumor_matches_a_fresh_solve(tmp_path):
+    import load_data as ld
+    from plan_cache import cached_solve
+    
+    old = set_sink(None)
+    try:
+        specs = ld.get_specs('smallexample')
+        c, t, b = ld.load_data('smallexample', specs)
+        cache = PlanCache(str(tmp_path))
+        fresh = cached_solve('build_model_4', specs, c, t, b, cache = cache)
+        hit = cached_solve('build_model_4', specs, c, t, b, cache = cache)
+    finally:
+        set_sink(old)
+    
+    assert hit.tumor.dtype == fresh.tumor.dtype
+    assert np.array_equal(hit.tumor, fresh.tumor)
+    assert np.array_equal(hit.dose, fresh.dose)
@@ -0,0 +1,32 @@
+import copy
+
+import numpy as np
+import pytest
+
+import load_data as ld
+import models as md
+from geometry import region_masks
+from plan import solve_plan
+from planner import Planner
+from instrument import set_sink
+
+
+@pytest.mark.parametrize('backend', ['highs', 'cplex'])
+def test_new_pixel_weights_match_a_fresh_solve(backend):
+    old = set_sink(None)
+    try:
+        specs = ld.get_specs('actualexample')
+        c, t, b = ld.load_data('actualexample', specs)
+        plan = md.build_model_3(specs, c, t, b, solve = False)
+        plan.log_output = False
+        planner = Planner(copy.deepcopy(plan), backend)
+        planner.solve()
+        
+        weights = np.asarray(c) + 0.9 * region_masks(c, t, 1, 10)['c_neighbor']
+        warm = planner.set_pixel_weights(weights).solve()
+        plan.beam_cost = plan.D.beam_weights(weights)
+        fresh = solve_plan(plan, 'highs')
+    finally:
+        set_sink(old)
+    
+    assert np.isclose(warm.objective_value, fresh.objective_value, rtol = 1e-7)
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+import load_data as ld
+from plan import solve_plan
+from robust import build_robust_model
+from instrument import set_sink
+
+
+@pytest.fixture
+def robust_plan():
+    old = set_sink(None)
+    specs = ld.get_specs('smallexample')
+    c, t, b = ld.load_data('smallexample', specs)
+    plan, t_model = build_robust_model(specs, c, t, b, solve = False)
+    yield plan
+    set_sink(old)
+
+
+@pytest.mark.parametrize('options', [{'presolve': True}, {'lazy': True}, {'start': np.zeros(5)}])
+def test_solve_plan_rejects_nominal_only_paths(robust_plan, options):
+    with pytest.raises(ValueError):
+        solve_plan(robust_plan, 'highs', **options)
+
+
+def test_start_vector_is_rejected(robust_plan):
+    with pytest.raises(ValueError):
+        robust_plan.start_vector(np.zeros(robust_plan.D.num_beams))
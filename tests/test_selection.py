@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import load_data as ld
+import models as md
+from selection import greedy_path, selection_curve, select_beams_milp
+from instrument import set_sink
+
+
+@pytest.fixture(scope = 'module')
+def data():
+    old = set_sink(None)
+    specs = ld.get_specs('actualexample')
+    c, t, b = ld.load_data('actualexample', specs)
+    set_sink(old)
+    return specs, c, t, b
+
+
+def _plan(data, model_name):
+    old = set_sink(None)
+    try:
+        plan = getattr(md, model_name)(*data, solve = False)
+    finally:
+        set_sink(old)
+    plan = plan[0] if isinstance(plan, tuple) else plan
+    plan.log_output = False
+    return plan
+
+
+def test_negative_costs_are_rejected(data):
+    plan = _plan(data, 'build_model_1')
+    assert np.any(plan.cost() < 0)
+    with pytest.raises(ValueError):
+        greedy_path(plan, 5)
+    with pytest.raises(ValueError):
+        selection_curve(plan, [1, 2])
+
+
+def test_greedy_path_is_close_to_the_milp(data):
+    plan = _plan(data, 'build_model_4')
+    path = greedy_path(plan, 5)
+    assert len(set(path)) == len(path) == 5
+    
+    old = set_sink(None)
+    try:
+        curve = selection_curve(plan, [5], swaps = True)
+        exact = select_beams_milp(plan, 5, 'highs')
+    finally:
+        set_sink(old)
+    assert curve['objective'].iloc[0] <= 1.1 * exact.objective_value
@@ -0,0 +1,161 @@
+import os
+import json
+import numpy as np
+from scipy import sparse
+
+from influence import DoseInfluence
+from geometry import region_masks
+from plan import PlanLP
+
+
+def write_volume(path, beams, grid_shape, dtype = np.float32):
+    """Write beam maps to disk one beam at a time as sparse blocks, so only one beam is ever in memory
+    
+    beams is any iterable of dense beam maps, each holding prod(grid_shape) values, such as the
+    (beams, rows, cols) array from load_data or a generator reading one beam per slice stack."""
+    
+    grid_shape = tuple(int(n) for n in grid_shape)
+    size = int(np.prod(grid_shape))
+    os.makedirs(path, exist_ok = True)
+    
+    # Each beam's non-zero pixels are appended in increasing pixel order
+    indptr = [0]
+    with open(path + '/indices.bin', 'wb') as fi, open(path + '/data.bin', 'wb') as fd:
+        for beam in beams:
+            flat = np.asarray(beam).ravel()
+            if flat.size != size:
+                raise ValueError('Beam has ' + str(flat.size) + ' values, expected ' + str(size))
+            idx = np.flatnonzero(flat)
+            fi.write(idx.astype(np.int64).tobytes())
+            fd.write(flat[idx].astype(dtype).tobytes())
+            indptr.append(indptr[-1] + len(idx))
+    np.save(path + '/indptr.npy', np.asarray(indptr, dtype = np.int64))
+    with open(path + '/volume.json', 'w') as f:
+        json.dump({'grid_shape': list(grid_shape), 'dtype': np.dtype(dtype).str}, f)
+    
+    return BeamVolume(path)
+
+
+
+class BeamVolume():
+    """Memory-mapped per-beam sparse blocks over a (slices, rows, cols) grid"""
+    
+    def __init__(self, path):
+        with open(path + '/volume.json') as f:
+            meta = json.load(f)
+        self.path = path
+        self.grid_shape = tuple(meta['grid_shape'])
+        if len(self.grid_shape) == 2:
+            self.grid_shape = (1,) + self.grid_shape
+        self.slice_size = int(np.prod(self.grid_shape[1:]))
+        self.indptr = np.load(path + '/indptr.npy')
+        self.num_beams = len(self.indptr) - 1
+        nnz = int(self.indptr[-1])
+        
+        # Pages are only read when a beam or slice touches them
+        self.indices = np.memmap(path + '/indices.bin', dtype = np.int64, mode = 'r', shape = (nnz,)) \
+                       if nnz else np.zeros(0, dtype = np.int64)
+        self.data = np.memmap(path + '/data.bin', dtype = np.dtype(meta['dtype']), mode = 'r', shape = (nnz,)) \
+                    if nnz else np.zeros(0, dtype = np.dtype(meta['dtype']))
+        
+    def mask(self, m):
+        """Return a region mask on the volume grid; a 2D mask is taken as a single slice"""
+        
+        return np.asarray(m).reshape(self.grid_shape)
+    
+    def beam_range(self, i, lo, hi):
+        """Return the flat pixel indices and doses of beam i for pixels in [lo, hi)"""
+        
+        a, b = self.indptr[i], self.indptr[i + 1]
+        idx = self.indices[a:b]
+        start, end = np.searchsorted(idx, [lo, hi])
+        
+        return idx[start:end], self.data[a + start:a + end]
+    
+    def slice_matrix(self, s, rows = None):
+        """Return the (slice pixels x beams) influence matrix of slice s, or only its listed local rows"""
+        
+        lo = s * self.slice_size
+        r, cols, vals = [], [], []
+        for i in range(0, self.num_beams):
+            idx, data = self.beam_range(i, lo, lo + self.slice_size)
+            r.append(idx - lo)
+            cols.append(np.full(len(idx), i))
+            vals.append(data)
+        M = sparse.csr_matrix((np.concatenate(vals).astype(float), (np.concatenate(r), np.concatenate(cols))),
+                              shape = (self.slice_size, self.num_beams))
+        
+        return M if rows is None else M[rows]
+    
+    def iter_dose_slices(self, x):
+        """Yield (slice, dose map) for intensities x, holding only one slice at a time"""
+        
+        x = np.asarray(x, dtype = float)
+        for s in range(0, self.grid_shape[0]):
+            yield s, (self.slice_matrix(s) @ x).reshape(self.grid_shape[1:])
+    
+    def dose(self, x, out = None):
+        """Return the dose volume for intensities x, streamed slice by slice into out if given
+        (for example a np.memmap on disk)"""
+        
+        if out is None:
+            out = np.zeros(self.grid_shape, dtype = np.float32)
+        for s, m in self.iter_dose_slices(x):
+            out[s] = m
+            
+        return out
+    
+    def beam_weights(self, weights):
+        """Return, per beam, the total dose weighted by a per-pixel weight map, one beam at a time"""
+        
+        w = np.asarray(weights, dtype = float).ravel()
+        costs = np.zeros(self.num_beams)
+        for i in range(0, self.num_beams):
+            a, b = self.indptr[i], self.indptr[i + 1]
+            costs[i] = w[self.indices[a:b]] @ self.data[a:b]
+            
+        return costs
+    
+    def region_influence(self, rows):
+        """Return a compact DoseInfluence whose row k is the volume pixel rows[k], built slice by slice"""
+        
+        rows = np.asarray(rows, dtype = np.int64)
+        blocks, order = [], np.argsort(rows, kind = 'stable')
+        bounds = np.searchsorted(rows[order], np.arange(0, self.grid_shape[0] + 1) * self.slice_size)
+        for s in range(0, self.grid_shape[0]):
+            local = rows[order[bounds[s]:bounds[s + 1]]] - s * self.slice_size
+            if len(local):
+                blocks.append(self.slice_matrix(s, local))
+        M = sparse.vstack(blocks, format = 'csr') if blocks else sparse.csr_matrix((0, self.num_beams))
+        
+        # Put the rows back in the order they were asked for
+        inverse = np.empty(len(rows), dtype = int)
+        inverse[order] = np.arange(0, len(rows))
+        
+        return DoseInfluence.from_matrix(M[inverse], (len(rows), 1))
+
+
+
+def build_volume_model(volume, c, t, max_dose, min_dose, p_neighbor = 0.5, p_regrow = 0.1, 
+                       margin_width = 1, interior_size = 10, tumor_ub = 20):
+    """Build the model 4 plan over a beam volume, streaming the influence rows of only the region
+    pixels; returns the plan and the tumor mask with its interior removed"""
+    
+    c, t = volume.mask(c).astype(float), volume.mask(t).astype(float)
+    masks = region_masks(c, t, margin_width, interior_size)
+    c_neighbor, tr = masks['c_neighbor'], masks['tr']
+    t = t - tr
+    
+    critical_rows = np.flatnonzero(c.ravel() == 1)
+    tumor_rows = np.flatnonzero(t.ravel() == 1)
+    D = volume.region_influence(np.concatenate((critical_rows, tumor_rows)))
+    
+    # Rows of the compact influence matrix: critical pixels first, then tumor pixels
+    plan = PlanLP('volume', D, np.arange(0, len(critical_rows)), 
+                  len(critical_rows) + np.arange(0, len(tumor_rows)), max_dose, min_dose,
+                  volume.beam_weights(c + p_neighbor * c_neighbor),
+                  critical_cost = np.ones(len(critical_rows)), 
+                  tumor_cost = (t + tr * p_regrow).ravel()[tumor_rows],
+                  critical_ub = None, tumor_ub = tumor_ub)
+    
+    return plan, t